@@ -4,14 +4,17 @@
 
 
 
+import argparse
 import logging
 import sys
 
-from afr import entity
-from afr import entitycomponents
+from afr import game
+from afr import levels
 from afr import map as game_map
 from afr import player
+from afr import replay
 from afr import screen
+from afr import simulation
 from afr import util
 
 logging.basicConfig(level=logging.INFO,
@@ -19,99 +22,52 @@ logging.basicConfig(level=logging.INFO,
 
 MAP_WIDTH = 40
 MAP_HEIGHT = 40
+ROOMS = 5
 ALLOWED_KEYS = set('qhjklyubn')
 
 
-def tick(action):
-    """Run game turn. Return success."""
-    # XXX: assumes there is only one player entity, but doesn't enforce it
-    for e in entity.entities:
-        if e.has_component('player'):
-            if e.current_hp <= 0:
-                logging.info("Game over!")
-                sys.exit()
-            logging.debug("Handling player action for {}".format(e))
-            try:
-                player.handle_player_action(action, e)
-            except player.ActionError as e:
-                logging.info("Couldn't perform action {action} ({reason})"
-                             .format(action=action, reason=e))
-                return False
-    for e in entity.entities:
-        if e.has_component('ai') and not e.has_component('player'):
-            logging.debug("Running AI for %s" % e.name)
-            e.run_ai()
-    return True
-
-
 def main():
     """Main game loop."""
-    # Mapgen
-    game_map.CreateMap(width=MAP_WIDTH, height=MAP_HEIGHT)
-    game_map.map.generate_interior(rooms=5)
-
-    # Test creature init
-    coords = [game_map.map.get_empty_coordinates() for i in range(5)]
-
-    p = entity.Entity('Urist', components=[
-        entitycomponents.Creature(max_hp=100),
-        entitycomponents.Fighter(strength=5, team='dwarves'),
-        entitycomponents.Corporeal(x=coords[0][0], y=coords[0][1],
-                                       icon='@', zorder=1),
-        entitycomponents.AI(),
-        entitycomponents.Inventory(),
-        entitycomponents.Player(),
-    ]
-    )
-    entity.entities.add(p)
-
-    entity.entities.add(
-        entity.Entity('Goblin King', components=[
-            entitycomponents.Creature(max_hp=40, size='small'),
-            entitycomponents.Fighter(strength=10, team='goblins'),
-            entitycomponents.Corporeal(x=coords[1][0], y=coords[1][1]),
-            entitycomponents.AI(),
-        ]
-        )
-    )
-    entity.entities.add(
-        entity.Entity(
-            'Sword',
-            components=[
-                entitycomponents.Corporeal(
-                    x=coords[2][0],
-                    y=coords[2][1],
-                    icon='(',
-                    blocks_movement=False,
-                    zorder=-1),
-                entitycomponents.Equippable(
-                    strength=10),
-            ]))
-    entity.entities.add(
-        entity.Entity('Goblin King', components=[
-            entitycomponents.Creature(max_hp=40, size='small'),
-            entitycomponents.Fighter(strength=10, team='goblins'),
-            entitycomponents.Corporeal(x=coords[3][0], y=coords[3][1]),
-            entitycomponents.AI(),
-        ]
-        )
-    )
-    entity.entities.add(
-        entity.Entity('Goblin King', components=[
-            entitycomponents.Creature(max_hp=40, size='small'),
-            entitycomponents.Fighter(strength=10, team='goblins'),
-            entitycomponents.Corporeal(x=coords[4][0], y=coords[4][1]),
-            entitycomponents.AI(),
-        ]
-        )
-    )
-
-    # Event loop
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seed', type=int, default=None,
+                        help='world seed; random by default')
+    parser.add_argument('--record', metavar='FILE',
+                        help='write a replayable log of the game to FILE')
+    parser.add_argument('--levels', type=int, default=1,
+                        help="number of dungeon levels (stairs are '<' and "
+                        "'>')")
+    args = parser.parse_args()
+    if args.levels > 1 and args.record:
+        parser.error("--record only supports single level games")
+
+    # Mapgen and test creature init
+    world_args = dict(width=MAP_WIDTH, height=MAP_HEIGHT, rooms=ROOMS)
+    if args.levels > 1:
+        dungeon = levels.new_game(args.levels, seed=args.seed, **world_args)
+        p = dungeon.player
+        tick = dungeon.tick
+    else:
+        w, p = simulation.build_world(seed=args.seed, **world_args)
+        tick = game.tick
+    log = None
+    if args.record:
+        log = open(args.record, 'w')
+        tick = replay.Recorder(log, w.seed, world_args).tick
+    try:
+        play(p, tick)
+    finally:
+        if log is not None:
+            log.close()
+
+
+def play(p, tick):
+    """Event loop: draw, read a key, run tick(action). Exits when done."""
     n_tick = 0
     run = True
     while run:
-        logging.debug("Tick: %s" % n_tick)
-        screen.draw_map(game_map.map, focus=p)
+        logging.debug("Tick: %s", n_tick)
+        screen.draw_map(game_map.map, focus=p,
+                        visible=game_map.map.field_of_view(p.x, p.y))
         action = None
         while not action:
             try:
@@ -122,7 +78,11 @@ def main():
             action = player.key_to_action(key)
             if not action:
                 logging.warning("Unknown key '%s'", key)
-        did_tick = tick(action=action)
+        try:
+            did_tick = tick(action)
+        except game.GameOver:
+            logging.info("Game over!")
+            sys.exit()
         if did_tick:
             n_tick += 1
 
@@ -0,0 +1,235 @@
+"""Seeded benchmarks for the game's hot paths.
+
+Prints one JSON object per benchmark case, so runs can be saved and diffed:
+
+    python -m afr.benchmark > before.json
+    python -m afr.benchmark --compare before.json
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from afr import entity
+from afr import entitycomponents
+from afr import game
+from afr import screen
+from afr import snapshot
+from afr import world
+
+SEED = 1234
+MAP_SIZES = (40, 100, 200)
+ENTITY_COUNTS = (10, 100)
+# Anything this much slower than the --compare baseline is flagged
+REGRESSION_RATIO = 1.2
+
+
+def _time(func, repeat):
+    """Call func repeat times, return the list of durations in seconds."""
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _result(name, params, durations):
+    return {
+        'benchmark': name,
+        'params': params,
+        'runs': len(durations),
+        'min': min(durations),
+        'mean': sum(durations) / len(durations),
+    }
+
+
+def _world(size, rooms=None):
+    """Return an active world with a generate_interior map of size x size."""
+    w = world.World(seed=SEED).activate()
+    w.create_map(width=size, height=size)
+    w.map.generate_interior(rooms=rooms or max(5, size // 8))
+    return w
+
+
+def _goblin(x, y):
+    return entity.Entity('Goblin', components=[
+        entitycomponents.Creature(max_hp=40, size='small'),
+        entitycomponents.Fighter(strength=10, team='goblins'),
+        entitycomponents.Corporeal(x=x, y=y),
+        entitycomponents.AI(),
+    ])
+
+
+def bench_generate(size, repeat):
+    """Map.generate and Map.generate_interior."""
+    w = _world(size)
+    yield _result('Map.generate', {'size': size},
+                  _time(w.map.generate, repeat))
+    yield _result('Map.generate_interior', {'size': size},
+                  _time(lambda: w.map.generate_interior(
+                      rooms=max(5, size // 8)), repeat))
+
+
+def bench_neighbors(size, repeat):
+    """A full Map.updateTileNeighbors rebuild."""
+    w = _world(size)
+    yield _result('Map.updateTileNeighbors', {'size': size},
+                  _time(w.map.updateTileNeighbors, repeat))
+
+
+def bench_pathfind(size, repeat):
+    """Map.pathfind between nearby and far apart points."""
+    w = _world(size)
+    points = [w.map.get_empty_coordinates() for i in range(200)]
+    pairs = [(a, b) for a in points for b in points if a != b]
+    short = [p for p in pairs if w.map.distance_between(
+        p[0][0], p[0][1], p[1][0], p[1][1]) <= 10][:repeat]
+    far = sorted(pairs, key=lambda p: -w.map.distance_between(
+        p[0][0], p[0][1], p[1][0], p[1][1]))[:repeat]
+    for route, chosen in (('short', short), ('long', far)):
+        if not chosen:
+            continue
+        routes = iter(chosen)
+
+        def pathfind_next():
+            (x1, y1), (x2, y2) = next(routes)
+            w.map.pathfind(x1, y1, x2, y2)
+
+        yield _result('Map.pathfind', {'size': size, 'route': route},
+                      _time(pathfind_next, len(chosen)))
+
+
+def bench_tick(size, goblins, repeat):
+    """game.tick with a player and some AI goblins."""
+    w = _world(size)
+    p = game.populate(w.map)
+    p.current_hp = p.max_hp = 10 ** 9  # keep the game going
+    for i in range(goblins):
+        x, y = w.map.get_empty_coordinates()
+        w.entities.add(_goblin(x, y))
+    yield _result('game.tick', {'size': size, 'goblins': goblins},
+                  _time(lambda: game.tick('wait'), repeat))
+
+
+def bench_draw_map(size, goblins, repeat):
+    """screen.draw_map centred on the player."""
+    w = _world(size)
+    p = game.populate(w.map)
+    for i in range(goblins):
+        x, y = w.map.get_empty_coordinates()
+        w.entities.add(_goblin(x, y))
+    yield _result('screen.draw_map', {'size': size, 'goblins': goblins},
+                  _time(lambda: screen.draw_map(w.map, focus=p), repeat))
+    with open(os.devnull, 'w') as devnull:
+        renderer = screen.DiffRenderer(devnull)
+        yield _result('screen.draw_map', {'size': size, 'goblins': goblins,
+                                          'renderer': 'diff'},
+                      _time(lambda: screen.draw_map(w.map, focus=p,
+                                                    renderer=renderer),
+                            repeat))
+
+
+def bench_snapshot(size, repeat):
+    """snapshot.save and snapshot.load of a populated world."""
+    w = _world(size)
+    game.populate(w.map)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'world.afrs')
+        yield _result('snapshot.save', {'size': size},
+                      _time(lambda: snapshot.save(w, path), repeat))
+        yield _result('snapshot.load', {'size': size},
+                      _time(lambda: snapshot.load(path), repeat))
+
+
+def bench_entity_get(repeat):
+    """Entity.get on a creature with equipped items."""
+    _world(40)
+    holder = entity.Entity('Holder', components=[
+        entitycomponents.Creature(max_hp=10),
+        entitycomponents.Fighter(strength=5, team='dwarves'),
+    ])
+    holder.equip(entity.Entity('Sword', components=[
+        entitycomponents.Equippable(strength=10)]))
+    holder.equip(entity.Entity('Mail', components=[
+        entitycomponents.Equippable(slot='torso', strength=1)]))
+
+    def get_many():
+        for i in range(1000):
+            holder.get('strength')
+
+    yield _result('Entity.get', {'equipped': 2, 'calls': 1000},
+                  _time(get_many, repeat))
+
+
+def run_all(repeat=20, sizes=MAP_SIZES, entity_counts=ENTITY_COUNTS):
+    """Yield results for every benchmark case."""
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        for size in sizes:
+            for r in bench_generate(size, repeat):
+                yield r
+            for r in bench_neighbors(size, repeat):
+                yield r
+            for r in bench_pathfind(size, repeat):
+                yield r
+            for r in bench_snapshot(size, repeat):
+                yield r
+            for goblins in entity_counts:
+                for r in bench_tick(size, goblins, repeat):
+                    yield r
+                for r in bench_draw_map(size, goblins, repeat):
+                    yield r
+        for r in bench_entity_get(repeat):
+            yield r
+
+
+def _key(result):
+    return (result['benchmark'], json.dumps(result['params'], sort_keys=True))
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='timed runs per case')
+    parser.add_argument('--quick', action='store_true',
+                        help='only the smallest map size and entity count')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='earlier output to compare mean times against')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR,
+                        format="%(filename)s (%(funcName)s) %(message)s")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    baseline[_key(r)] = r
+
+    sizes = MAP_SIZES[:1] if args.quick else MAP_SIZES
+    counts = ENTITY_COUNTS[:1] if args.quick else ENTITY_COUNTS
+    regressions = 0
+    # run_all silences stdout around the benchmarks, so hang on to it
+    stdout = sys.stdout
+    for result in run_all(args.repeat, sizes, counts):
+        old = baseline.get(_key(result))
+        if old is not None and old['mean'] > 0:
+            result['ratio'] = result['mean'] / old['mean']
+            if result['ratio'] > REGRESSION_RATIO:
+                result['regression'] = True
+                regressions += 1
+        print(json.dumps(result, sort_keys=True), file=stdout)
+        stdout.flush()
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""Unbounded maps generated a chunk at a time.
+
+A ChunkedMap has no edges: terrain is split into square chunks, each
+generated the first time something looks at it, from the map's seed and the
+chunk's coordinates alone. So a chunk can be dropped and regenerated
+identically later. Only max_chunks chunks are kept in memory, evicting
+those furthest from any entity first (then the least recently used);
+chunks changed with setTile are saved (in memory or to a directory) when
+evicted instead of being regenerated.
+
+Coordinates may be any integers, including negative ones. width and height
+are None.
+"""
+
+import collections
+import heapq
+import itertools
+import logging
+import os
+import random
+
+import afr.entity
+import afr.map
+from afr.map import PASSABLE, TILE_TYPE_IDS, TILE_TYPE_NAMES, \
+    TILE_TYPE_TABLE, DIRECTIONS, ICONS, MapTile
+
+CHUNK_SIZE = 32
+# Chunks kept in memory before the least recently used one is evicted
+MAX_CHUNKS = 64
+MAX_ROOMS_PER_CHUNK = 3
+# How far (in steps) flow fields reach out from their goals
+FLOW_RADIUS = 48
+# Nodes A* may expand before giving up; the map never runs out otherwise
+MAX_SEARCH_NODES = 20000
+
+
+class LocalFlowField(object):
+
+    """FlowField for maps without edges.
+
+    Step distances only reach FLOW_RADIUS steps out from the goals and are
+    kept in a dict keyed by (x, y) instead of a flat array.
+    """
+
+    UNREACHABLE = afr.map.FlowField.UNREACHABLE
+
+    def __init__(self, map, goals, radius=FLOW_RADIUS):
+        """Build the field for map towards goals, an iterable of (x, y)."""
+        self.map = map
+        self.goals = frozenset(goals)
+        self.generation = map.generation
+        distance = {}
+        queue = collections.deque()
+        for goal in self.goals:
+            distance[goal] = 0
+            queue.append(goal)
+        while queue:
+            x, y = queue.popleft()
+            next_distance = distance[(x, y)] + 1
+            if next_distance > radius:
+                continue
+            for dx, dy in DIRECTIONS:
+                node = (x + dx, y + dy)
+                if node not in distance and map.tile_passable(*node):
+                    distance[node] = next_distance
+                    queue.append(node)
+        self.distance = distance
+
+    def distance_from(self, x, y):
+        """Return steps from x,y to the nearest goal, or None if unreachable.
+        """
+        return self.distance.get((x, y))
+
+    def next_step(self, x, y):
+        """Return (dx, dy) of the best unblocked downhill move from x,y.
+
+        Returns None if there is no such move.
+        """
+        here = self.distance.get((x, y))
+        if not here:
+            return None
+        best = None
+        best_distance = here
+        for dx, dy in DIRECTIONS:
+            node = (x + dx, y + dy)
+            d = self.distance.get(node)
+            if d is not None and d < best_distance and \
+                    (node in self.goals or
+                     not afr.entity.spatial.blocked(*node)):
+                best = (dx, dy)
+                best_distance = d
+        return best
+
+
+class ChunkedMap(afr.map.BaseMap):
+
+    """A map of lazily generated, evictable chunks.
+
+    Tiles returned by getTile are detached MapTiles; write changes back with
+    setTile. Unlike afr.map.Map there's no flat terrain array, so whole-map
+    generation, hierarchical pathfinding and snapshots don't apply.
+    """
+
+    flow_field_class = LocalFlowField
+
+    def __init__(self, seed, rng=None, chunk_size=CHUNK_SIZE,
+                 max_chunks=MAX_CHUNKS, directory=None):
+        """Create an empty chunked map.
+
+        seed determines every chunk's terrain. rng is used for spawn points
+        (see get_empty_coordinates) and defaults to the current world's
+        mapgen stream. Changed chunks are written to files in directory when
+        evicted, or kept in memory if it's None.
+        """
+        super(ChunkedMap, self).__init__(rng)
+        # No edges
+        self.width = None
+        self.height = None
+        self.max_path_length = MAX_SEARCH_NODES
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.directory = directory
+        # (cx, cy) -> terrain bytearray, least recently used first
+        self.chunks = collections.OrderedDict()
+        # Chunks changed since they were generated
+        self.dirty = set()
+        # (cx, cy) -> terrain bytes of changed chunks evicted to memory
+        self.evicted = {}
+        self._last_key = None
+        self._last_chunk = None
+
+    def chunk_of(self, x, y):
+        """Return the (cx, cy) chunk containing x,y."""
+        return (x // self.chunk_size, y // self.chunk_size)
+
+    def _chunk(self, cx, cy):
+        """Return the terrain of chunk cx,cy, loading it if needed."""
+        key = (cx, cy)
+        if key == self._last_key:
+            return self._last_chunk
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self._load_chunk(key)
+            self.chunks[key] = chunk
+            if len(self.chunks) > self.max_chunks:
+                occupied = self._occupied_chunks()
+                while len(self.chunks) > self.max_chunks:
+                    self._evict(self._eviction_victim(key, occupied))
+        else:
+            self.chunks.move_to_end(key)
+        self._last_key = key
+        self._last_chunk = chunk
+        return chunk
+
+    def _occupied_chunks(self):
+        """Return the set of chunks holding corporeal entities."""
+        if self.occupancy is None:
+            return set()
+        return set(self.chunk_of(x, y) for x, y in self.occupancy.cells)
+
+    def _eviction_victim(self, loading, occupied):
+        """Return the chunk to evict to make room for chunk loading.
+
+        The chunk furthest (in chunks) from any in occupied goes, so those
+        that entities are in or near stay loaded; ties go to the least
+        recently used.
+        """
+        victim = None
+        furthest = -1
+        for key in self.chunks:  # least recently used first
+            if key == loading:
+                continue
+            if not occupied:
+                return key
+            cx, cy = key
+            distance = min(max(abs(cx - ox), abs(cy - oy))
+                           for ox, oy in occupied)
+            if distance > furthest:
+                victim = key
+                furthest = distance
+        return victim
+
+    def _chunk_path(self, key):
+        return os.path.join(self.directory, '%s_%s.chunk' % key)
+
+    def _load_chunk(self, key):
+        terrain = self.evicted.pop(key, None)
+        if terrain is None and self.directory is not None and \
+                os.path.exists(self._chunk_path(key)):
+            with open(self._chunk_path(key), 'rb') as f:
+                terrain = f.read()
+        if terrain is None:
+            return self.generate_chunk(*key)
+        # Still differs from what generate_chunk would give
+        self.dirty.add(key)
+        return bytearray(terrain)
+
+    def _evict(self, key):
+        """Drop chunk key from memory, saving it first if it was changed."""
+        terrain = self.chunks.pop(key)
+        if key == self._last_key:
+            self._last_key = self._last_chunk = None
+        if key in self.dirty:
+            self.dirty.discard(key)
+            if self.directory is not None:
+                with open(self._chunk_path(key), 'wb') as f:
+                    f.write(terrain)
+            else:
+                self.evicted[key] = bytes(terrain)
+
+    def generate_chunk(self, cx, cy):
+        """Return the freshly generated terrain of chunk cx,cy.
+
+        Depends only on the map's seed and cx,cy. Corridors run through the
+        middle row and column of every chunk, so they join up with the
+        neighbouring chunks' corridors, and each room is tunnelled to the
+        middle column.
+        """
+        rng = random.Random('%s:chunk:%s,%s' % (self.seed, cx, cy))
+        cs = self.chunk_size
+        dirt = bytearray([TILE_TYPE_IDS['dirt']])
+        terrain = bytearray([TILE_TYPE_IDS['stone']]) * (cs * cs)
+        mid = cs // 2
+        terrain[mid * cs:(mid + 1) * cs] = dirt * cs
+        terrain[mid::cs] = dirt * cs
+        for room in range(rng.randint(1, MAX_ROOMS_PER_CHUNK)):
+            width = rng.randint(2, 6)
+            height = rng.randint(2, 6)
+            startx = rng.randint(1, cs - 1 - width)
+            starty = rng.randint(1, cs - 1 - height)
+            for y in range(starty, starty + height):
+                terrain[y * cs + startx:y * cs + startx + width] = \
+                    dirt * width
+            # Tunnel along one of the room's rows to the middle column
+            y = rng.randint(starty, starty + height - 1)
+            lo = min(startx, mid)
+            hi = max(startx + width, mid + 1)
+            terrain[y * cs + lo:y * cs + hi] = dirt * (hi - lo)
+        return terrain
+
+    def tile_id(self, x, y):
+        """Return the tile type id at x,y."""
+        cs = self.chunk_size
+        cx, lx = divmod(x, cs)
+        cy, ly = divmod(y, cs)
+        return self._chunk(cx, cy)[ly * cs + lx]
+
+    def row_ids(self, y, x1, x2):
+        """Return the tile type ids of x1 <= x < x2 on row y as a bytearray.
+        """
+        cs = self.chunk_size
+        cy, ly = divmod(y, cs)
+        ids = bytearray()
+        x = x1
+        while x < x2:
+            cx, lx = divmod(x, cs)
+            end = min(cs, lx + x2 - x)
+            start = ly * cs
+            ids += self._chunk(cx, cy)[start + lx:start + end]
+            x += end - lx
+        return ids
+
+    def getTile(self, x, y):
+        """Return a detached MapTile for x,y."""
+        return MapTile(TILE_TYPE_NAMES[self.tile_id(x, y)], x, y)
+
+    def tile_type(self, x, y):
+        """Return the TileType at x,y."""
+        return TILE_TYPE_TABLE[self.tile_id(x, y)]
+
+    def row_icons(self, y, x1, x2):
+        """Return the icons of tiles x1 <= x < x2 on row y."""
+        return [ICONS[t] for t in self.row_ids(y, x1, x2)]
+
+    def setTile(self, x, y, tile):
+        """Set tile at x,y to tile (a MapTile or tile type name)."""
+        type = tile.type if isinstance(tile, MapTile) else tile
+        new = TILE_TYPE_IDS[type]
+        cs = self.chunk_size
+        cx, lx = divmod(x, cs)
+        cy, ly = divmod(y, cs)
+        chunk = self._chunk(cx, cy)
+        if chunk[ly * cs + lx] != new:
+            chunk[ly * cs + lx] = new
+            self.dirty.add((cx, cy))
+            self.generation += 1
+
+    def _spawn_cells(self):
+        """Return the traversable tiles of the chunk at the origin."""
+        cs = self.chunk_size
+        return [(x, y) for y in range(cs) for x in range(cs)
+                if self.tile_is_traversable(x, y)]
+
+    def free_cell_count(self):
+        """Return how many tiles of the origin chunk are free."""
+        return len(self._spawn_cells())
+
+    def get_empty_coordinates(self):
+        """Return a random traversable tile in the chunk at the origin."""
+        cells = self._spawn_cells()
+        if not cells:
+            raise RuntimeError("Failed to find empty coordinates!")
+        return cells[self.rng.randrange(len(cells))]
+
+    def get_many_empty_coordinates(self, count):
+        """Return count distinct random traversable tiles near the origin."""
+        cells = self._spawn_cells()
+        if count > len(cells):
+            raise RuntimeError("Only %s empty coordinates, wanted %s!" %
+                               (len(cells), count))
+        return self.rng.sample(cells, count)
+
+    def tile_passable(self, x, y):
+        """True if the terrain at x,y is passable, ignoring entities."""
+        return PASSABLE[self.tile_id(x, y)]
+
+    def tile_is_traversable(self, x, y):
+        """True if given tile is traversable."""
+        return PASSABLE[self.tile_id(x, y)] and \
+            not afr.entity.spatial.blocked(x, y)
+
+    def _compute_field_of_view(self, x, y, radius):
+        """Shadowcast over a copy of the square of terrain around x,y."""
+        size = 2 * radius + 1
+        window = bytearray()
+        for j in range(y - radius, y + radius + 1):
+            window += self.row_ids(j, x - radius, x + radius + 1)
+        cells = afr.map.shadowcast(window, size, size, radius, radius,
+                                   radius)
+        dx = x - radius
+        dy = y - radius
+        return set((i + dx, j + dy) for i, j in cells)
+
+    def pathfind(self, x1, y1, x2, y2):
+        """Return a list of MapTiles leading to x2,y2, or None.
+
+        Gives up after expanding max_path_length nodes.
+        """
+        path = self._search(x1, y1, x2, y2)
+        if path is None:
+            logging.warning("Cound't find path!")
+            return None
+        return [MapTile(TILE_TYPE_NAMES[self.tile_id(x, y)], x, y)
+                for x, y in path]
+
+    def _search(self, x1, y1, x2, y2):
+        """A* over (x, y) coordinates. Return the path after x1,y1 or None.
+        """
+        start = (x1, y1)
+        end = (x2, y2)
+        blocked = afr.entity.spatial.blocked
+        g = {start: 0}
+        parent = {}
+        closedset = set()
+        seq = itertools.count()
+        h = self.path_heuristic(x1, y1, x2, y2)
+        openheap = [(h, h, next(seq), start)]
+        cycles = 0
+        while openheap and cycles < self.max_path_length:
+            current = heapq.heappop(openheap)[3]
+            if current in closedset:
+                continue
+            cycles += 1
+            if current == end:
+                self.nodes_expanded += cycles
+                path = []
+                while current in parent:
+                    path.append(current)
+                    current = parent[current]
+                return path[::-1]
+            closedset.add(current)
+            current_g = g[current]
+            cx, cy = current
+            for dx, dy in DIRECTIONS:
+                node = (cx + dx, cy + dy)
+                if node in closedset or not self.tile_passable(*node):
+                    continue
+                if node != end and blocked(*node):
+                    closedset.add(node)
+                    continue
+                new_g = current_g + (afr.map.SQRT2 if dx and dy else 1)
+                if new_g < g.get(node, new_g + 1):
+                    g[node] = new_g
+                    parent[node] = current
+                    h = self.path_heuristic(node[0], node[1], x2, y2)
+                    heapq.heappush(openheap, (new_g + h, h, next(seq), node))
+        self.nodes_expanded += cycles
+        return None
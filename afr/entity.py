@@ -6,6 +6,9 @@ The global entity store holds all entities.
 
 import logging
 
+import afr.registry
+import afr.spatial
+
 
 class Entity(object):
 
@@ -22,6 +25,10 @@ class Entity(object):
         name is a human-readable tag.
         components is an iterable of components to attach.
         """
+        # Resolved get() results: attrib -> {base: value}
+        self._attribute_cache = {}
+        # Entities whose get() results depend on ours (eg whoever holds us)
+        self._attribute_dependents = set()
         self.name = name
         self.components = {}
         for c in components:
@@ -35,7 +42,7 @@ class Entity(object):
                 "Component by the name %s is already attached to entity %s." %
                 (name, self.name))
         else:
-            logging.debug("Attaching %s to %s" % (name, self.name))
+            logging.debug("Attaching %s to %s", name, self.name)
             component.owner = self
             self.components[name] = component
             if hasattr(component, 'export'):
@@ -44,8 +51,11 @@ class Entity(object):
                         raise AttributeError(
                             "Component exports %s which is already in use "
                             "on entity %s." % (obj, self.name))
-                    logging.debug("Setting attribute %s" % obj)
+                    logging.debug("Setting attribute %s", obj)
                     setattr(self, obj, getattr(component, obj))
+            registry.attached(self, name)
+            component.on_attach()
+            self.invalidate_attributes()
 
     def detach_component(self, name):
         """Detach EntityComponent by name."""
@@ -54,12 +64,26 @@ class Entity(object):
                 "Entity %s has no attached component named %s." %
                 (self.name, name))
         else:
-            logging.debug("Detaching %s from %s" % (name, self.name))
+            logging.debug("Detaching %s from %s", name, self.name)
             component = self.components[name]
+            component.on_detach()
             del(self.components[name])
             if hasattr(component, 'export'):
                 for obj in component.export:
                     delattr(self, obj)
+            registry.detached(self, name)
+            self.invalidate_attributes()
+
+    def __setattr__(self, name, value):
+        """Set an attribute, keeping the spatial index in step with position.
+
+        Changing an attribute that get() has cached invalidates the cache.
+        """
+        object.__setattr__(self, name, value)
+        if name in ('x', 'y', 'blocks_movement') and self in spatial:
+            spatial.update(self)
+        if name in self.__dict__.get('_attribute_cache', ()):
+            self.invalidate_attributes()
 
     def has_component(self, component):
         """Check if a component is attached by name."""
@@ -71,7 +95,16 @@ class Entity(object):
         Specify base to use a different base value than this entities' (eg when
         modifying a parent entity (eg sword with +str modifying the holder's
         strength))
+
+        Results are cached until invalidate_attributes is called. That happens
+        automatically when components are attached/detached, the attribute
+        is set on this entity or an attribute of one of its components is
+        set; modifiers that change some other way (eg mutating a dict held
+        by a component) must call it themselves.
         """
+        cached = self._attribute_cache.get(attrib)
+        if cached is not None and base in cached:
+            return cached[base]
         val = base if base is not None else getattr(self, attrib)
         #logging.debug("Getting attribute %s for %s (initial: %s)",
                       #attrib, self.name, val)
@@ -83,8 +116,26 @@ class Entity(object):
                 #logging.debug("Component %s modified attribute (new: %s)",
                               #c, val)
                 pass
+        self._attribute_cache.setdefault(attrib, {})[base] = val
         return val
 
+    def invalidate_attributes(self):
+        """Forget cached get() results here and on dependent entities."""
+        if self._attribute_cache:
+            self._attribute_cache.clear()
+        for e in self._attribute_dependents:
+            e.invalidate_attributes()
+
+    def add_attribute_dependent(self, entity):
+        """Invalidate entity's get() cache whenever ours is invalidated."""
+        self._attribute_dependents.add(entity)
+        entity.invalidate_attributes()
+
+    def remove_attribute_dependent(self, entity):
+        """Undo add_attribute_dependent."""
+        self._attribute_dependents.discard(entity)
+        entity.invalidate_attributes()
+
     def __str__(self):
         """Basic display for now."""
         return "<Entity {}>".format(self.name)
@@ -96,15 +147,49 @@ class Entity(object):
 global entities
 entities = set()
 
+# Corporeal entities bucketed by position, maintained by the Corporeal
+# component and Entity.__setattr__
+spatial = afr.spatial.SpatialIndex()
+
+
+# Entities by attached component, maintained by Entity.attach_component and
+# Entity.detach_component
+registry = afr.registry.ComponentRegistry()
+
+
+def query(*components, **kwargs):
+    """Return a list of entities with all the named components.
+
+    exclude=[names] leaves out entities having any of those components.
+    """
+    return registry.query(components, kwargs.get('exclude', ()))
+
+
+def nearest(x, y, radius, *components, **kwargs):
+    """Return the closest entity to x,y with all the named components.
+
+    Only entities within radius (euclidean) are considered, and only
+    corporeal ones since it searches the spatial index. where=func limits
+    it to entities for which func(entity) is true. Returns None if nothing
+    matches.
+    """
+    where = kwargs.get('where')
+
+    def match(e):
+        for c in components:
+            if c not in e.components:
+                return False
+        return where is None or where(e)
+
+    return spatial.nearest(x, y, radius, match)
+
 
 def at_position(x, y, blocks_movement=None):
     """Return a list of entities at the given position.
 
     blocks_movement=True/False will only consider relevant entities. Default None considers all.
     """
+    found = spatial.at(x, y)
     if blocks_movement is not None:
-        func = lambda e: e.has_component(
-            'corporeal') and e.x == x and e.y == y and e.blocks_movement == blocks_movement
-    else:
-        func = lambda e: e.x == x and e.y == y
-    return [e for e in entities if func(e)]
+        found = [e for e in found if e.blocks_movement == blocks_movement]
+    return found
@@ -36,6 +36,42 @@ class EntityComponent(object):
         """The default constructor does nothing."""
         pass
 
+    def __setattr__(self, name, value):
+        """Set an attribute, forgetting the owner's cached get() results.
+
+        Modifiers (eg an Equippable's bonuses) usually read component
+        attributes, so changing one can change what the owner's get returns.
+        """
+        object.__setattr__(self, name, value)
+        owner = self.__dict__.get('owner')
+        if owner is not None and name != 'owner':
+            owner.invalidate_attributes()
+
+    def on_attach(self):
+        """Called once the component is attached and its exports are set."""
+        pass
+
+    def on_detach(self):
+        """Called just before the component and its exports are removed."""
+        pass
+
+    def get_state(self):
+        """Return a dict of this component's state, eg for afr.snapshot.
+
+        Exported values are read back from the owner, which is where they
+        change.
+        """
+        state = dict((k, v) for k, v in vars(self).items() if k != 'owner')
+        for name in getattr(self, 'export', ()):
+            value = getattr(self.owner, name)
+            if not callable(value):
+                state[name] = value
+        return state
+
+    def set_state(self, state):
+        """Restore get_state's result onto an unattached component."""
+        vars(self).update(state)
+
     def modify_attribute(self, attrib, cur):
         """A default no-op for attribute modification."""
         return cur
@@ -1,20 +1,72 @@
 import logging
-import random
-
 import afr.map
+import afr.rng
+import afr.scheduler
 from afr.entitycomponent import EntityComponent
 
+# Chasers of one target needed before they share a flow field instead of
+# each running A*
+FLOW_FIELD_MIN_MOVERS = 3
+# Turns an AI wanders without finding a target before it falls asleep
+IDLE_TURNS = 10
+
 
 class AI(EntityComponent):
 
     """Entity has a brain."""
 
-    def __init__(self):
-        """Create an AI entity."""
+    def __init__(self, asleep=False):
+        """Create an AI entity.
+
+        An asleep AI is parked in the scheduler, costing nothing, until
+        something wakes it (see wake). Awake AIs fall asleep after IDLE_TURNS
+        turns with nothing in view to go after.
+        """
         self.brainstate = {}
+        self.asleep = asleep
 
         self.export = ['run_ai']
 
+    def on_attach(self):
+        """Schedule the owner's turns, unless the player drives it."""
+        if self.owner.has_component('player'):
+            return
+        scheduler = afr.scheduler.scheduler
+        scheduler.schedule(self.owner)
+        if self.asleep:
+            scheduler.park(self.owner)
+
+    def on_detach(self):
+        """Stop scheduling the owner."""
+        afr.scheduler.scheduler.unschedule(self.owner)
+
+    def wake(self):
+        """Wake the owner up if it's asleep, scheduling it to act again."""
+        if self.asleep:
+            self.asleep = False
+            self.brainstate.pop('idle_turns', None)
+            afr.scheduler.scheduler.wake(self.owner)
+
+    def _doze(self):
+        """Count an idle turn, falling asleep after IDLE_TURNS of them."""
+        state = self.brainstate
+        state['idle_turns'] = state.get('idle_turns', 0) + 1
+        if state['idle_turns'] >= IDLE_TURNS and \
+                not self.owner.has_component('player'):
+            logging.debug("%s falls asleep", self.owner.name)
+            self.asleep = True
+            afr.scheduler.scheduler.park(self.owner)
+            return True
+        return False
+
+    def get_state(self):
+        """Component state, less the cached path (replanned on demand)."""
+        state = super(AI, self).get_state()
+        state['brainstate'] = dict(
+            (k, v) for k, v in self.brainstate.items()
+            if not k.startswith('path'))
+        return state
+
     def _is_valid_target(self):
         state = self.brainstate
         if 'target' in state and \
@@ -36,7 +88,7 @@ class AI(EntityComponent):
         if self._is_valid_target():
             return
         if 'target' not in state:
-            logging.debug("Finding target for %s" % me.name)
+            logging.debug("Finding target for %s", me.name)
             if me.has_component('inventory'):
                 pickupable = me.find_nearby_pickupable()
                 if pickupable:
@@ -51,7 +103,7 @@ class AI(EntityComponent):
                     state['target_distance'] = 1
                     state['target_action'] = 'attack'
         if 'target' not in state:
-            logging.debug("Can't find a target for %s" % me.name)
+            logging.debug("Can't find a target for %s", me.name)
 
     def _move_towards_target(self):
         me = self.owner
@@ -60,10 +112,11 @@ class AI(EntityComponent):
         logging.debug("Using target: %s (%s, %s)",
                       target.name, target.x, target.y)
 
-        path = afr.map.map.pathfind(me.x,
-                                    me.y,
-                                    target.x,
-                                    target.y)
+        if state['target_action'] == 'attack' and \
+                self._follow_flow_field(target):
+            return
+
+        path = self._path_to(target)
         if path is None:
             logging.debug("Can't find path!")
         elif len(path) == state['target_distance']:
@@ -79,21 +132,89 @@ class AI(EntityComponent):
                 logging.debug("Found path, %s steps. Next step is %s, %s",
                               len(path), dx, dy)
                 me.move(dx, dy)
+                del(path[0])
             else:
                 logging.debug("Pathfinding says we're there already!!")
 
-    def run_ai(self):
-        """Stupid generic creature brain."""
+    def _path_to(self, target):
+        """Return the path to target, re-planning only when needed.
+
+        The last path is kept in the brainstate and walked step by step. It's
+        thrown away if the map changed, the target moved, or the next step
+        isn't where we are or is now blocked.
+        """
+        me = self.owner
+        state = self.brainstate
+        m = afr.map.map
+        goal = (target.x, target.y)
+        path = state.get('path')
+        if path is not None:
+            if state['path_map'] is not m or \
+                    state['path_generation'] != m.generation or \
+                    state['path_goal'] != goal:
+                path = None
+            elif path:
+                step = path[0]
+                if abs(step.x - me.x) > 1 or abs(step.y - me.y) > 1 or \
+                        ((step.x, step.y) != goal and
+                         not m.tile_is_traversable(step.x, step.y)):
+                    path = None
+        if path is None:
+            path = m.pathfind(me.x, me.y, target.x, target.y)
+            state['path'] = path
+            state['path_map'] = m
+            state['path_generation'] = m.generation
+            state['path_goal'] = goal
+        return path
+
+    def _follow_flow_field(self, target):
+        """Step along a flow field shared with others chasing target.
+
+        Combat targets are often chased by several creatures at once, and
+        then one flow field is cheaper than an A* each. Returns False
+        (without acting) if there aren't enough chasers to be worth a field
+        yet, or we're outside it, so the caller should use A* instead.
+        """
+        me = self.owner
+        state = self.brainstate
+        field = afr.map.map.flow_field([(target.x, target.y)],
+                                       demand=FLOW_FIELD_MIN_MOVERS)
+        if field is None:
+            return False
+        distance = field.distance_from(me.x, me.y)
+        if distance is None:
+            return False
+        elif distance == state['target_distance']:
+            getattr(me, state['target_action'])(target)
+        else:
+            step = field.next_step(me.x, me.y)
+            if step is None:
+                logging.debug("Every way towards the target is blocked")
+            else:
+                me.move(*step)
+        return True
+
+    def run_ai(self, rng=None):
+        """Stupid generic creature brain.
+
+        rng is the random.Random to decide with, by default the current
+        world's ai stream.
+        """
+        if rng is None:
+            rng = afr.rng.streams.ai
         state = self.brainstate
         me = self.owner
         if not self.owner.alive:
             return
         self._acquire_target()
         if 'target' in state:
+            state.pop('idle_turns', None)
             self._move_towards_target()
+        elif self._doze():
+            return
         else:
             # No target, wander around
-            if random.random() > 0.3:
+            if rng.random() > 0.3:
                 possible_directions = [i for i in
                                        ([-1, -1], [-1, 0], [-1, 1], [0, -1],
                                         [0, 1], [1, -1], [1, 0], [1, 1])
@@ -103,6 +224,7 @@ class AI(EntityComponent):
                                        )
                                        ]
                 logging.debug("possible directions: %s", possible_directions)
-                movement = random.choice(possible_directions)
-                me.x += movement[0]
-                me.y += movement[1]
+                if possible_directions:  # we may be boxed in
+                    movement = rng.choice(possible_directions)
+                    me.x += movement[0]
+                    me.y += movement[1]
@@ -1,3 +1,4 @@
+import afr.entity
 import afr.map
 from afr.entitycomponent import EntityComponent
 
@@ -23,6 +24,14 @@ class Corporeal(EntityComponent):
 
         self.export = ['x', 'y', 'icon', 'blocks_movement', 'zorder', 'move']
 
+    def on_attach(self):
+        """Start tracking the owner in the spatial index."""
+        afr.entity.spatial.add(self.owner)
+
+    def on_detach(self):
+        """Stop tracking the owner in the spatial index."""
+        afr.entity.spatial.remove(self.owner)
+
     def move(self, dx, dy):
         """Move entity dx,dy tiles.
 
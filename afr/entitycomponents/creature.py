@@ -1,5 +1,6 @@
 import logging
 
+import afr.scheduler
 from afr.entitycomponent import EntityComponent
 
 SLOTS = {'humanoid': ['hand-left', 'torso']}
@@ -12,17 +13,29 @@ class Creature(EntityComponent):
     Creatures have hitpoints and can be alive or dead.
     They also have a size/shape, which influences eg equip slots."""
 
-    def __init__(self, max_hp, shape='humanoid', size='medium'):
-        """Create a creature with max_hp hp."""
+    def __init__(self, max_hp, shape='humanoid', size='medium',
+                 speed=afr.scheduler.NORMAL_SPEED):
+        """Create a creature with max_hp hp.
+
+        speed sets how often it acts, see afr.scheduler.
+        """
         self.max_hp = max_hp
         self.shape = shape
         self.size = size
+        self.speed = speed
 
         self.current_hp = max_hp
         self.alive = True
         self.slots = dict.fromkeys(SLOTS.get(shape, []))
 
-        self.export = ['max_hp', 'current_hp', 'alive', 'slots', 'equip']
+        self.export = ['max_hp', 'current_hp', 'alive', 'slots', 'speed',
+                       'equip']
+
+    def on_attach(self):
+        """Depend on already equipped items (eg when loading a snapshot)."""
+        for item in self.slots.values():
+            if item:
+                item.add_attribute_dependent(self.owner)
 
     def modify_attribute(self, attrib, cur):
         """See if any equipped items modify the attrib."""
@@ -56,7 +69,8 @@ class Creature(EntityComponent):
 
         assert not item.has_component('corporeal')
         self.slots[target_slot] = item
-        logging.debug(
-            "%s equips %s in slot %s" %
-            (self.owner.name, item.name, target_slot))
+        # Our modified attributes now depend on the item's
+        item.add_attribute_dependent(self.owner)
+        logging.debug("%s equips %s in slot %s",
+                      self.owner.name, item.name, target_slot)
         return True
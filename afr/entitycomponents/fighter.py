@@ -1,6 +1,6 @@
-import random
-
 import afr.entity
+import afr.map
+import afr.rng
 from afr.entitycomponent import EntityComponent
 
 
@@ -19,26 +19,17 @@ class Fighter(EntityComponent):
         self.export = ['strength', 'team', 'find_combat_target', 'attack',
                        'die']
 
-    def find_combat_target(self):
-        """Return closest enemy or None.
+    def find_combat_target(self, radius=afr.map.SIGHT_RADIUS):
+        """Return closest enemy in sight or None.
 
         XXX: assumes all fighters are corporeal(?).
         """
-        candidates = [e for e in afr.entity.entities if
-                      (e.has_component('corporeal') and
-                       e.has_component('fighter') and
-                       e.alive and
-                       e.team != self.owner.team)
-                      ]
-        try:
-            return min(candidates,
-                       key=lambda c:
-                       afr.map.map.distance_between(self.owner.x,
-                                                    self.owner.y,
-                                                    c.x,
-                                                    c.y))
-        except ValueError:  # min can't handle empty lists
-            return None
+        me = self.owner
+        visible = afr.map.map.field_of_view(me.x, me.y, radius)
+        return afr.entity.nearest(
+            me.x, me.y, radius, 'fighter',
+            where=lambda e: e.alive and e.team != me.team and
+            (e.x, e.y) in visible)
 
     def die(self):
         """Kill the fighter."""
@@ -46,15 +37,23 @@ class Fighter(EntityComponent):
         self.owner.blocks_movement = False
         self.owner.icon = 'x'
 
-    def attack(self, defender):
+    def attack(self, defender, rng=None):
         """Attack another entity and resolve results.
 
+        rng is the random.Random to roll with, by default the current world's
+        combat stream.
+
         Note: does not check if the attack is valid, you have to do that
         yourself.
         """
+        if rng is None:
+            rng = afr.rng.streams.combat
         attacker = self.owner
-        attacker_str = random.randint(0, attacker.get('strength'))
-        defender_str = random.randint(0, defender.get('strength'))
+        # Being attacked wakes anything sleeping
+        if defender.has_component('ai'):
+            defender.components['ai'].wake()
+        attacker_str = rng.randint(0, attacker.get('strength'))
+        defender_str = rng.randint(0, defender.get('strength'))
 
         if attacker_str == 0 or defender_str > attacker_str:
             dmg = (defender_str - attacker_str) // 2
@@ -1,6 +1,7 @@
 import logging
 
 import afr.entity
+import afr.map
 from afr.entitycomponent import EntityComponent
 
 
@@ -26,19 +27,11 @@ class Inventory(EntityComponent):
         """
         entity.detach_component('corporeal')
         self.inventory.append(entity)
-        logging.debug("%s picks up %s" % (self.owner.name, entity.name))
-
-    def find_nearby_pickupable(self):
-        """Return closest pickupable or None."""
-        candidates = [e for e in afr.entity.entities if
-                      (e.has_component('corporeal') and
-                       e.has_component('equippable'))]
-        if candidates:
-            best = min(candidates,
-                       key=lambda c:
-                       afr.map.map.distance_between(self.owner.x,
-                                                    self.owner.y,
-                                                    c.x, c.y))
-        else:
-            best = None
-        return best
+        logging.debug("%s picks up %s", self.owner.name, entity.name)
+
+    def find_nearby_pickupable(self, radius=afr.map.SIGHT_RADIUS):
+        """Return closest pickupable in sight or None."""
+        me = self.owner
+        visible = afr.map.map.field_of_view(me.x, me.y, radius)
+        return afr.entity.nearest(me.x, me.y, radius, 'equippable',
+                                  where=lambda e: (e.x, e.y) in visible)
@@ -1,8 +1,20 @@
+import afr.scheduler
 from afr.entitycomponent import EntityComponent
 
 
 class Player(EntityComponent):
 
-    """Entity is controlled by the player."""
+    """Entity is controlled by the player.
 
-    pass
+    The player acts once per game tick, so isn't left to the scheduler even
+    if it has an AI.
+    """
+
+    def on_attach(self):
+        """Take the owner out of the scheduler."""
+        afr.scheduler.scheduler.unschedule(self.owner)
+
+    def on_detach(self):
+        """Hand the owner back to the scheduler if it has a brain."""
+        if self.owner.has_component('ai'):
+            afr.scheduler.scheduler.schedule(self.owner)
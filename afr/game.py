@@ -0,0 +1,130 @@
+"""Game rules shared by the interactive client and headless runs."""
+
+import logging
+
+import afr.map
+from afr import entity
+from afr import entitycomponents
+from afr import player
+from afr import scheduler
+
+
+class GameOver(Exception):
+
+    """Raised by tick once the player is dead."""
+
+    pass
+
+
+def populate(m):
+    """Add the starting cast of entities to map m. Return the player."""
+    coords = m.get_many_empty_coordinates(5)
+
+    p = entity.Entity('Urist', components=[
+        entitycomponents.Creature(max_hp=100),
+        entitycomponents.Fighter(strength=5, team='dwarves'),
+        entitycomponents.Corporeal(x=coords[0][0], y=coords[0][1],
+                                       icon='@', zorder=1),
+        entitycomponents.AI(),
+        entitycomponents.Inventory(),
+        entitycomponents.Player(),
+    ]
+    )
+    entity.entities.add(p)
+
+    entity.entities.add(
+        entity.Entity('Goblin King', components=[
+            entitycomponents.Creature(max_hp=40, size='small'),
+            entitycomponents.Fighter(strength=10, team='goblins'),
+            entitycomponents.Corporeal(x=coords[1][0], y=coords[1][1]),
+            entitycomponents.AI(),
+        ]
+        )
+    )
+    entity.entities.add(
+        entity.Entity(
+            'Sword',
+            components=[
+                entitycomponents.Corporeal(
+                    x=coords[2][0],
+                    y=coords[2][1],
+                    icon='(',
+                    blocks_movement=False,
+                    zorder=-1),
+                entitycomponents.Equippable(
+                    strength=10),
+            ]))
+    entity.entities.add(
+        entity.Entity('Goblin King', components=[
+            entitycomponents.Creature(max_hp=40, size='small'),
+            entitycomponents.Fighter(strength=10, team='goblins'),
+            entitycomponents.Corporeal(x=coords[3][0], y=coords[3][1]),
+            entitycomponents.AI(),
+        ]
+        )
+    )
+    entity.entities.add(
+        entity.Entity('Goblin King', components=[
+            entitycomponents.Creature(max_hp=40, size='small'),
+            entitycomponents.Fighter(strength=10, team='goblins'),
+            entitycomponents.Corporeal(x=coords[4][0], y=coords[4][1]),
+            entitycomponents.AI(),
+        ]
+        )
+    )
+    return p
+
+
+def populate_monsters(m, count):
+    """Add count goblins to map m. Return them."""
+    goblins = []
+    for x, y in m.get_many_empty_coordinates(count):
+        goblin = entity.Entity('Goblin', components=[
+            entitycomponents.Creature(max_hp=40, size='small'),
+            entitycomponents.Fighter(strength=10, team='goblins'),
+            entitycomponents.Corporeal(x=x, y=y),
+            entitycomponents.AI(),
+        ])
+        entity.entities.add(goblin)
+        goblins.append(goblin)
+    return goblins
+
+
+def tick(action):
+    """Run game turn. Return success.
+
+    action is a player action name (see player.KEY_MAP), or None to let the
+    player's own AI decide. Raises GameOver if the player is dead.
+    """
+    # XXX: assumes there is only one player entity, but doesn't enforce it
+    for e in entity.query('player'):
+        if e.current_hp <= 0:
+            raise GameOver()
+        logging.debug("Handling player action for %s", e)
+        if action is None:
+            e.run_ai()
+        else:
+            try:
+                player.handle_player_action(action, e)
+            except player.ActionError as error:
+                logging.info("Couldn't perform action {action} ({reason})"
+                             .format(action=action, reason=error))
+                return False
+        wake_onlookers(e)
+    # Everyone else acts as often as their speed allows this turn
+    scheduler.scheduler.advance(scheduler.TURN)
+    return True
+
+
+def wake_onlookers(e):
+    """Wake the sleeping AIs that can see e (eg the player after it moved).
+
+    Looks at what's in e's field of view rather than at every sleeper, so
+    it costs the same however many are asleep.
+    """
+    cells = entity.spatial.cells
+    for pos in afr.map.map.field_of_view(e.x, e.y):
+        for other in cells.get(pos, ()):
+            ai = other.components.get('ai')
+            if ai is not None and ai.asleep:
+                ai.wake()
@@ -0,0 +1,264 @@
+"""Hierarchical pathfinding (HPA*) over an afr.map.Map.
+
+The map is cut into square clusters. Wherever passable tiles face each other
+across a cluster border we place an entrance: a pair of abstract nodes, one
+on each side. Long paths are found by searching this small graph of
+entrances first, then refining each hop with an A* confined to one cluster.
+"""
+
+import heapq
+import itertools
+
+import afr.map
+
+# Openings at least this wide get an entrance at each end rather than one in
+# the middle, so paths along wide corridors don't detour via the centre.
+WIDE_ENTRANCE = 6
+
+
+class HierarchicalPathfinder(object):
+
+    """Abstract graph of cluster entrances over a Map.
+
+    Entrances are kept up to date by Map.setTile through tile_changed. The
+    costs between entrances inside a cluster are worked out lazily the first
+    time a search passes through that cluster.
+    """
+
+    def __init__(self, map, cluster_size=16):
+        """Build the abstraction for map with square clusters."""
+        self.map = map
+        self.cluster_size = cluster_size
+        self.rebuild()
+
+    def rebuild(self):
+        """Recompute every entrance from scratch."""
+        cs = self.cluster_size
+        self.clusters_x = (self.map.width + cs - 1) // cs
+        self.clusters_y = (self.map.height + cs - 1) // cs
+        # (cluster, cluster) -> [((x, y), (x, y)), ...] entrance pairs
+        self.borders = {}
+        # node -> set of nodes directly across a border from it
+        self.inter = {}
+        # cluster -> set of entrance nodes inside it
+        self.nodes = {}
+        # cluster -> {node: {node: cost}}, filled in by _intra_edges
+        self.intra = {}
+        for cx in range(self.clusters_x):
+            for cy in range(self.clusters_y):
+                if cx + 1 < self.clusters_x:
+                    self._build_border((cx, cy), (cx + 1, cy))
+                if cy + 1 < self.clusters_y:
+                    self._build_border((cx, cy), (cx, cy + 1))
+
+    def cluster_of(self, x, y):
+        """Return the (cx, cy) cluster containing x,y."""
+        return (x // self.cluster_size, y // self.cluster_size)
+
+    def bounds(self, cluster):
+        """Return the inclusive (minx, miny, maxx, maxy) of a cluster."""
+        cs = self.cluster_size
+        x0 = cluster[0] * cs
+        y0 = cluster[1] * cs
+        return (x0, y0,
+                min(x0 + cs, self.map.width) - 1,
+                min(y0 + cs, self.map.height) - 1)
+
+    def tile_changed(self, x, y):
+        """Update the abstraction after the tile at x,y changed passability.
+        """
+        cluster = self.cluster_of(x, y)
+        self.intra.pop(cluster, None)
+        x0, y0, x1, y1 = self.bounds(cluster)
+        cx, cy = cluster
+        if x == x0 and cx > 0:
+            self._build_border((cx - 1, cy), cluster)
+        if x == x1 and cx + 1 < self.clusters_x:
+            self._build_border(cluster, (cx + 1, cy))
+        if y == y0 and cy > 0:
+            self._build_border((cx, cy - 1), cluster)
+        if y == y1 and cy + 1 < self.clusters_y:
+            self._build_border(cluster, (cx, cy + 1))
+
+    def _passable(self, x, y):
+        m = self.map
+        return afr.map.PASSABLE[m.terrain[y * m.width + x]]
+
+    def _build_border(self, a, b):
+        """(Re)compute the entrances between cluster a and the one after it.
+        """
+        for pair in self.borders.pop((a, b), ()):
+            self._unlink(*pair)
+        ax0, ay0, ax1, ay1 = self.bounds(a)
+        if b[0] != a[0]:
+            # b is to the right of a
+            cells = [((ax1, y), (ax1 + 1, y)) for y in range(ay0, ay1 + 1)]
+        else:
+            # b is below a
+            cells = [((x, ay1), (x, ay1 + 1)) for x in range(ax0, ax1 + 1)]
+        pairs = []
+        run = []
+        for pair in cells + [None]:
+            if pair is not None and self._passable(*pair[0]) and \
+                    self._passable(*pair[1]):
+                run.append(pair)
+                continue
+            if len(run) >= WIDE_ENTRANCE:
+                pairs.extend((run[0], run[-1]))
+            elif run:
+                pairs.append(run[len(run) // 2])
+            run = []
+        self.borders[(a, b)] = pairs
+        for pair in pairs:
+            self._link(*pair)
+        self.intra.pop(a, None)
+        self.intra.pop(b, None)
+
+    def _link(self, p, q):
+        for node, other in ((p, q), (q, p)):
+            self.inter.setdefault(node, set()).add(other)
+            self.nodes.setdefault(self.cluster_of(*node), set()).add(node)
+
+    def _unlink(self, p, q):
+        for node, other in ((p, q), (q, p)):
+            partners = self.inter[node]
+            partners.discard(other)
+            if not partners:
+                del(self.inter[node])
+                self.nodes[self.cluster_of(*node)].discard(node)
+
+    def _search_cluster(self, x, y, cluster, targets):
+        """Dijkstra from x,y without leaving cluster.
+
+        Returns {target: cost} for each of targets (an iterable of (x, y))
+        that can be reached.
+        """
+        m = self.map
+        width = m.width
+        neighbors = m.neighbors
+        x0, y0, x1, y1 = self.bounds(cluster)
+        targets = set(targets)
+        found = {}
+        start = y * width + x
+        cost = {start: 0}
+        done = set()
+        heap = [(0, start)]
+        while heap and len(found) < len(targets):
+            d, current = heapq.heappop(heap)
+            if current in done:
+                continue
+            done.add(current)
+            cy, cx = divmod(current, width)
+            if (cx, cy) in targets:
+                found[(cx, cy)] = d
+            mask = neighbors[current]
+            for n, (dx, dy) in enumerate(afr.map.DIRECTIONS):
+                if not mask & (1 << n):
+                    continue
+                nx = cx + dx
+                ny = cy + dy
+                if not (x0 <= nx <= x1 and y0 <= ny <= y1):
+                    continue
+                node = current + dy * width + dx
+                new_cost = d + (afr.map.SQRT2 if dx and dy else 1)
+                if new_cost < cost.get(node, new_cost + 1):
+                    cost[node] = new_cost
+                    heapq.heappush(heap, (new_cost, node))
+        m.nodes_expanded += len(done)
+        return found
+
+    def _intra_edges(self, cluster):
+        """Return {node: {node: cost}} for the entrances of cluster."""
+        edges = self.intra.get(cluster)
+        if edges is None:
+            nodes = self.nodes.get(cluster, set())
+            edges = {}
+            for node in nodes:
+                reached = self._search_cluster(node[0], node[1], cluster,
+                                               nodes)
+                reached.pop(node, None)
+                edges[node] = reached
+            self.intra[cluster] = edges
+        return edges
+
+    def pathfind(self, x1, y1, x2, y2):
+        """Return terrain indices of a path from x1,y1 to x2,y2, or None.
+
+        Only the first hop avoids entities; the rest of the path is planned
+        against terrain alone, since entities will have moved by the time
+        we get there.
+        """
+        m = self.map
+        start = (x1, y1)
+        goal = (x2, y2)
+        start_cluster = self.cluster_of(x1, y1)
+        goal_cluster = self.cluster_of(x2, y2)
+
+        # Temporarily hook start and goal into the abstract graph
+        targets = set(self.nodes.get(start_cluster, ()))
+        if start_cluster == goal_cluster:
+            targets.add(goal)
+        start_edges = self._search_cluster(x1, y1, start_cluster, targets)
+        goal_edges = self._search_cluster(
+            x2, y2, goal_cluster, self.nodes.get(goal_cluster, ()))
+
+        g = {start: 0}
+        parent = {}
+        closedset = set()
+        seq = itertools.count()
+        h = m.path_heuristic(x1, y1, x2, y2)
+        openheap = [(h, h, next(seq), start)]
+        while openheap:
+            current = heapq.heappop(openheap)[3]
+            if current in closedset:
+                continue
+            if current == goal:
+                break
+            closedset.add(current)
+            if current == start:
+                edges = list(start_edges.items())
+            else:
+                edges = list(self._intra_edges(
+                    self.cluster_of(*current)).get(current, {}).items())
+                if current in goal_edges:
+                    edges.append((goal, goal_edges[current]))
+            edges.extend((other, 1) for other in self.inter.get(current, ()))
+            for node, cost in edges:
+                if node in closedset:
+                    continue
+                new_g = g[current] + cost
+                if new_g < g.get(node, new_g + 1):
+                    g[node] = new_g
+                    parent[node] = current
+                    h = m.path_heuristic(node[0], node[1], x2, y2)
+                    heapq.heappush(openheap, (new_g + h, h, next(seq), node))
+        else:
+            # Entrances only join tiles straight across a border, so a gap
+            # crossed diagonally is invisible up here. Check on the full map.
+            return m._astar(x1, y1, x2, y2)
+
+        waypoints = [goal]
+        while waypoints[-1] in parent:
+            waypoints.append(parent[waypoints[-1]])
+        waypoints.reverse()
+
+        path = []
+        first = True
+        for a, b in zip(waypoints, waypoints[1:]):
+            if a == b:
+                continue
+            cluster = self.cluster_of(*a)
+            if cluster != self.cluster_of(*b):
+                # Hop across a border
+                path.append(m.index(*b))
+            else:
+                leg = m._astar(a[0], a[1], b[0], b[1],
+                               bounds=self.bounds(cluster),
+                               avoid_entities=first)
+                if leg is None:
+                    # Blocked in by entities right where we stand; let a
+                    # full search find a way round.
+                    return m._astar(x1, y1, x2, y2)
+                path.extend(leg)
+            first = False
+        return path
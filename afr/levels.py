@@ -0,0 +1,175 @@
+"""Multi-level dungeons.
+
+Each level is its own afr.world.World, joined to the next one down by a
+pair of stairs. Only the level the player is on (and any levels within
+sim_radius of it) is simulated each turn. The rest are frozen, and catch up
+when the player comes back: up to CATCH_UP_TURNS of their most recent turns
+are simulated and anything before that is skipped. So a turn costs the same
+however deep the dungeon gets.
+"""
+
+import logging
+
+import afr.rng
+import afr.world
+from afr import game
+from afr import player
+from afr import scheduler
+
+# Most turns a frozen level simulates when it's entered again
+CATCH_UP_TURNS = 20
+
+
+class LevelManager(object):
+
+    """The levels of a dungeon, the stairs between them and the player."""
+
+    def __init__(self, seed=None, sim_radius=0):
+        """Create an empty dungeon.
+
+        Level n's world is seeded from seed and n. sim_radius levels either
+        side of the player's are simulated alongside it.
+        """
+        self.seed = afr.rng.Streams(seed).seed
+        self.sim_radius = sim_radius
+        self.levels = []
+        # (depth, x, y) -> (depth, x, y) of the stairs at the other end
+        self.stairs = {}
+        self.player = None
+        self.depth = None
+        # Game time of the player's level, in scheduler units
+        self.time = 0
+
+    @property
+    def active(self):
+        """The World the player is on."""
+        return self.levels[self.depth]
+
+    def add_level(self, width, height, rooms, monsters=3):
+        """Generate a new bottom level, with stairs up to the one above.
+
+        The first level gets the player (see game.populate). Returns the new
+        level's World.
+        """
+        depth = len(self.levels)
+        w = afr.world.World(
+            seed='%s:level%s' % (self.seed, depth)).activate()
+        # A new level starts at the current time, not at the dawn of time
+        w.scheduler.time = self.time
+        w.create_map(width=width, height=height)
+        w.map.generate_interior(rooms=rooms)
+        self.levels.append(w)
+        if depth == 0:
+            self.player = game.populate(w.map)
+            self.depth = 0
+        else:
+            game.populate_monsters(w.map, monsters)
+            above = self.levels[depth - 1]
+            x1, y1 = above.map.get_empty_coordinates()
+            x2, y2 = w.map.get_empty_coordinates()
+            above.map.setTile(x1, y1, 'stairs_down')
+            w.map.setTile(x2, y2, 'stairs_up')
+            self.stairs[(depth - 1, x1, y1)] = (depth, x2, y2)
+            self.stairs[(depth, x2, y2)] = (depth - 1, x1, y1)
+        self.active.activate()
+        return w
+
+    def tick(self, action):
+        """Run a game turn on the player's level. Return success.
+
+        Works like game.tick, and also handles the 'use-stairs' action.
+        """
+        if action == 'use-stairs':
+            if self.player.current_hp <= 0:
+                raise game.GameOver()
+            try:
+                self._use_stairs()
+            except player.ActionError as e:
+                logging.info("Couldn't perform action %s (%s)", action, e)
+                return False
+            # Arriving takes the turn; let the new level have its go
+            game.wake_onlookers(self.player)
+            self.active.scheduler.advance(scheduler.TURN)
+        elif not game.tick(action):
+            return False
+        self.time += scheduler.TURN
+        if self.sim_radius:
+            for depth, level in enumerate(self.levels):
+                if depth != self.depth and \
+                        abs(depth - self.depth) <= self.sim_radius:
+                    self._catch_up(level)
+            self.active.activate()
+        return True
+
+    def _use_stairs(self):
+        p = self.player
+        here = (self.depth, p.x, p.y)
+        if here not in self.stairs:
+            raise player.ActionError("There are no stairs here.")
+        depth, x, y = self.stairs[here]
+        level = self.levels[depth]
+        self._catch_up(level)
+        if level.spatial.blocked(x, y):
+            self.active.activate()
+            raise player.ActionError("Something is blocking the stairs.")
+        self._forget(p, self.active)
+        self._move(p, self.active, level, (x, y))
+        self.depth = depth
+        self.active.activate()
+
+    def _catch_up(self, level):
+        """Bring a frozen level's clock up to the present."""
+        behind = (self.time - level.scheduler.time) // scheduler.TURN
+        if behind <= 0:
+            return
+        level.activate()
+        skipped = max(0, behind - CATCH_UP_TURNS)
+        if skipped:
+            level.scheduler.skip(skipped * scheduler.TURN)
+        for i in range(behind - skipped):
+            level.scheduler.advance(scheduler.TURN)
+
+    def _forget(self, entity, level):
+        """Make the AIs on level (and entity's own) stop chasing entity."""
+        for e in level.registry.query(['ai']):
+            brain = e.components['ai'].brainstate
+            if e is entity or brain.get('target') is entity:
+                brain.clear()
+
+    def _move(self, entity, source, dest, position=None):
+        """Move entity (and what it carries) from World source to dest.
+
+        position=(x, y) puts it there if it's corporeal.
+        """
+        carried = list(getattr(entity, 'inventory', ()))
+        carried.extend(item for item in getattr(entity, 'slots', {}).values()
+                       if item and item not in carried)
+        for item in carried:
+            self._move(item, source, dest)
+        source.activate()
+        # Exported values live on the entity; fold them back into the
+        # components before detaching so they come back unchanged.
+        components = [(c, c.get_state()) for c in entity.components.values()]
+        for name in reversed(list(entity.components)):
+            entity.detach_component(name)
+        listed = entity in source.entities
+        source.entities.discard(entity)
+        dest.activate()
+        for c, state in components:
+            if position is not None and 'x' in state and 'y' in state:
+                state['x'], state['y'] = position
+            c.set_state(state)
+            entity.attach_component(c)
+        if listed:
+            dest.entities.add(entity)
+
+
+def new_game(levels, width, height, rooms, seed=None, **kwargs):
+    """Return a LevelManager with levels levels already generated.
+
+    kwargs are passed to LevelManager.
+    """
+    manager = LevelManager(seed=seed, **kwargs)
+    for depth in range(levels):
+        manager.add_level(width, height, rooms)
+    return manager
@@ -1,42 +1,114 @@
 """Stores the map (eg terrain)."""
 
+import array
 import collections
+import heapq
 import itertools
 import logging
 import math
-import random
+import sys
 
+import afr.entity
+import afr.hpa
+import afr.rng
 import afr.util
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SQRT2 = math.sqrt(2)
+
 TileType = collections.namedtuple('TileType', ['passable', 'icon'])
 TILE_TYPES = {
     'dirt': TileType(passable=True, icon='.'),
     'floor': TileType(passable=True, icon='.'),
     'stone': TileType(passable=False, icon='#'),
     'boundary': TileType(passable=False, icon='#'),
+    'stairs_down': TileType(passable=True, icon='>'),
+    'stairs_up': TileType(passable=True, icon='<'),
 }
+# Terrain is stored as one byte per tile holding an index into this list
+TILE_TYPE_NAMES = ['dirt', 'floor', 'stone', 'boundary', 'stairs_down',
+                   'stairs_up']
+TILE_TYPE_IDS = dict((name, i) for i, name in enumerate(TILE_TYPE_NAMES))
+TILE_TYPE_TABLE = [TILE_TYPES[name] for name in TILE_TYPE_NAMES]
+PASSABLE = bytearray(t.passable for t in TILE_TYPE_TABLE)
+ICONS = [t.icon for t in TILE_TYPE_TABLE]
+
+# Neighbor directions. Bit n of a tile's neighbor mask is set if the tile
+# at offset DIRECTIONS[n] is passable terrain.
+DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1), (0, -1),
+              (0, 1), (1, -1), (1, 0), (1, 1))
+
+# How many flow fields a map keeps cached before dropping the oldest
+MAX_FLOW_FIELDS = 16
+# Flow fields only reach this many steps out from their goals
+FLOW_RADIUS = 32
+# How many field of view results a map keeps cached
+MAX_FIELDS_OF_VIEW = 256
+# Default view distance of creatures, in tiles
+SIGHT_RADIUS = 8
+# (xx, xy, yx, yy) transforms taking shadowcasting's first octant to each of
+# the eight octants
+OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+           (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
 
 
 class MapTile(object):
 
-    """Represents a Map Tile."""
+    """Represents a Map Tile.
+
+    Tiles returned by Map.getTile are lightweight views onto the map's terrain
+    array. Tiles created directly carry their own type and can be written into
+    a map with Map.setTile.
+    """
+
+    __slots__ = ('_map', '_type', 'x', 'y')
 
-    def __init__(self, type, x, y):
-        """Create a Map Tile of type with coords x,y."""
-        self.type = type
-        self.tile = TILE_TYPES[self.type]
+    def __init__(self, type, x, y, map=None):
+        """Create a Map Tile of type with coords x,y.
+
+        If map is given, the tile is a view and type is ignored.
+        """
+        if map is None and type not in TILE_TYPES:
+            raise KeyError(type)
+        self._map = map
+        self._type = type
         self.x = x
         self.y = y
 
-        # a star stuff
-        self.g = 0
-        self.h = 0
-        self.neighbors = set()
+    @property
+    def type(self):
+        """Name of the tile type."""
+        if self._map is None:
+            return self._type
+        return TILE_TYPE_NAMES[self._map.terrain[self._map.index(self.x,
+                                                                 self.y)]]
+
+    @property
+    def tile(self):
+        """TileType of the tile."""
+        return TILE_TYPES[self.type]
+
+    @property
+    def neighbors(self):
+        """Tiles next to this one with passable terrain."""
+        if self._map is None:
+            return []
+        mask = self._map.neighbors[self._map.index(self.x, self.y)]
+        return [MapTile(None, self.x + dx, self.y + dy, self._map)
+                for n, (dx, dy) in enumerate(DIRECTIONS) if mask & (1 << n)]
 
     def setType(self, type):
         """Change map tile type."""
-        self.type = type
-        self.tile = TILE_TYPES[self.type]
+        if self._map is None:
+            if type not in TILE_TYPES:
+                raise KeyError(type)
+            self._type = type
+        else:
+            self._map.setTile(self.x, self.y, type)
 
     def move_cost(self, other):
         """Move cost to a neighboring tile.
@@ -44,11 +116,20 @@ class MapTile(object):
         XXX: you must check the tiles are adjacent!
         """
         diagonal = abs(self.x - other.x) == 1 and abs(self.y - other.y) == 1
-        return math.sqrt(2) if diagonal else 1
+        return SQRT2 if diagonal else 1
+
+    def __eq__(self, other):
+        """Tiles are equal if they're at the same place with the same type."""
+        return isinstance(other, MapTile) and self.x == other.x and \
+            self.y == other.y and self.type == other.type
 
-    def clear_neighbors(self):
-        """Clear the list of neighbors."""
-        self.neighbors = set()
+    def __ne__(self, other):
+        """Inverse of __eq__."""
+        return not self == other
+
+    def __hash__(self):
+        """Hash by coordinates."""
+        return hash((self.x, self.y))
 
     def __str__(self):
         """Simple representation."""
@@ -60,102 +141,530 @@ class MapTile(object):
         return self.__str__()
 
 
-class Map(object):
+class FlowField(object):
+
+    """Step distance from tiles near a set of goals to the nearest goal.
+
+    Built with one breadth-first search over the terrain, out to radius
+    steps, then shared by everything heading for the same goals: each mover
+    just steps downhill. Entities are ignored when building the field and
+    only checked when picking a step.
+    """
+
+    UNREACHABLE = -1
+
+    def __init__(self, map, goals, radius=FLOW_RADIUS):
+        """Build the field for map towards goals, an iterable of (x, y)."""
+        self.map = map
+        self.goals = frozenset(goals)
+        self.generation = map.generation
+        width = map.width
+        neighbors = map.neighbors
+        distance = array.array('l', [self.UNREACHABLE]) * \
+            (width * map.height)
+        queue = collections.deque()
+        for x, y in self.goals:
+            i = map.index(x, y)
+            distance[i] = 0
+            queue.append(i)
+        steps = [dy * width + dx for dx, dy in DIRECTIONS]
+        while queue:
+            current = queue.popleft()
+            next_distance = distance[current] + 1
+            if next_distance > radius:
+                continue
+            mask = neighbors[current]
+            for n, step in enumerate(steps):
+                if mask & (1 << n):
+                    node = current + step
+                    if distance[node] == self.UNREACHABLE:
+                        distance[node] = next_distance
+                        queue.append(node)
+        self.distance = distance
+
+    def distance_from(self, x, y):
+        """Return steps from x,y to the nearest goal, or None if unreachable
+        (or further than the field reaches).
+        """
+        d = self.distance[self.map.index(x, y)]
+        return None if d == self.UNREACHABLE else d
+
+    def next_step(self, x, y):
+        """Return (dx, dy) of the best unblocked downhill move from x,y.
+
+        Returns None if there is no such move (unreachable, already at a goal
+        or every way forward is blocked).
+        """
+        m = self.map
+        width = m.width
+        here = self.distance[m.index(x, y)]
+        if here <= 0:
+            return None
+        mask = m.neighbors[y * width + x]
+        best = None
+        best_distance = here
+        for n, (dx, dy) in enumerate(DIRECTIONS):
+            if not mask & (1 << n):
+                continue
+            nx = x + dx
+            ny = y + dy
+            d = self.distance[ny * width + nx]
+            if d < best_distance and \
+                    ((nx, ny) in self.goals or
+                     not afr.entity.spatial.blocked(nx, ny)):
+                best = (dx, dy)
+                best_distance = d
+        return best
+
+
+def shadowcast(terrain, width, height, x, y, radius):
+    """Return the set of (x, y) cells of terrain visible from x,y.
+
+    terrain is a row-major sequence of tile type ids, width x height;
+    anything outside it is opaque. Uses recursive shadowcasting, one octant
+    at a time.
+    """
+    cells = set([(x, y)])
+    for octant in OCTANTS:
+        _cast_light(terrain, width, height, cells, x, y, radius, 1, 1.0, 0.0,
+                    *octant)
+    return cells
+
+
+def _cast_light(terrain, width, height, cells, cx, cy, radius, row, start,
+                end, xx, xy, yx, yy):
+    """Shadowcast one octant, adding lit cells to cells.
+
+    Scans rows outwards from row, between slopes start and end, and recurses
+    past each run of opaque tiles with the narrowed slopes.
+    """
+    if start < end:
+        return
+    radius_squared = radius * radius
+    new_start = start
+    for j in range(row, radius + 1):
+        dy = -j
+        blocked = False
+        for dx in range(-j, 1):
+            left_slope = (dx - 0.5) / (dy + 0.5)
+            right_slope = (dx + 0.5) / (dy - 0.5)
+            if start < right_slope:
+                continue
+            if end > left_slope:
+                break
+            mx = cx + dx * xx + dy * xy
+            my = cy + dx * yx + dy * yy
+            inside = 0 <= mx < width and 0 <= my < height
+            if inside and dx * dx + dy * dy <= radius_squared:
+                cells.add((mx, my))
+            opaque = not inside or not PASSABLE[terrain[my * width + mx]]
+            if blocked:
+                if opaque:
+                    new_start = right_slope
+                else:
+                    blocked = False
+                    start = new_start
+            elif opaque and j < radius:
+                blocked = True
+                _cast_light(terrain, width, height, cells, cx, cy, radius,
+                            j + 1, start, left_slope, xx, xy, yx, yy)
+                new_start = right_slope
+        if blocked:
+            break
+
+
+class BaseMap(object):
+
+    """What every kind of map shares: sight, flow fields and their caches.
+
+    Subclasses hold the terrain. They provide getTile, tile_type, row_icons,
+    setTile, tile_is_traversable, pathfind, get_empty_coordinates,
+    get_many_empty_coordinates, free_cell_count and _compute_field_of_view.
+    """
+
+    # Built by flow_field
+    flow_field_class = FlowField
+
+    def __init__(self, rng=None):
+        """Set up the caches and bookkeeping every map has.
+
+        rng is the random.Random used for generation and spawn points; it
+        defaults to the current world's mapgen stream.
+        """
+        self.rng = rng if rng is not None else afr.rng.streams.mapgen
+        # Bumped on every terrain change so cached pathing data can tell
+        # it's stale
+        self.generation = 0
+        # Running total of nodes expanded by searches, see afr.profiling
+        self.nodes_expanded = 0
+        self._flow_fields = collections.OrderedDict()
+        # goals -> (generation, requests) for fields not built yet
+        self._flow_requests = collections.OrderedDict()
+        # (x, y, radius) -> visible cells, for generation _fov_generation
+        self._fields_of_view = collections.OrderedDict()
+        self._fov_generation = 0
+        # Spatial index of the entities on the map, see track_occupancy
+        self.occupancy = None
+
+    def track_occupancy(self, index):
+        """Listen to index (an afr.spatial.SpatialIndex) for blocked tiles.
+
+        The map becomes index's listener, see cell_blocked/cell_unblocked.
+        """
+        if self.occupancy is not None:
+            self.occupancy.listener = None
+        self.occupancy = index
+        index.listener = self
 
-    """Represents the game world."""
+    def cell_blocked(self, x, y):
+        """Spatial index callback: a blocking entity arrived at x,y."""
+        pass
 
-    def __init__(self, width, height):
-        """Create a map object. Represents a single 2d level."""
+    def cell_unblocked(self, x, y):
+        """Spatial index callback: the last blocking entity left x,y."""
+        pass
+
+    def flow_field(self, goals, demand=1):
+        """Return a FlowField towards goals, an iterable of (x, y).
+
+        Fields are cached per goal set and rebuilt only once the terrain has
+        changed, so every mover chasing the same goals shares one search.
+
+        A field costs much more than a single A* search, so with demand > 1
+        a new field is only built on the demand'th request for the same
+        goals; until then None is returned and the caller should path on its
+        own.
+        """
+        key = frozenset(goals)
+        field = self._flow_fields.pop(key, None)
+        if field is None or field.generation != self.generation:
+            requests = self._flow_requests.pop(key, (self.generation, 0))
+            requests = (self.generation, requests[1] + 1
+                        if requests[0] == self.generation else 1)
+            if requests[1] < demand:
+                self._flow_requests[key] = requests
+                while len(self._flow_requests) > MAX_FLOW_FIELDS:
+                    self._flow_requests.popitem(last=False)
+                return None
+            field = self.flow_field_class(self, key)
+        self._flow_fields[key] = field
+        while len(self._flow_fields) > MAX_FLOW_FIELDS:
+            self._flow_fields.popitem(last=False)
+        return field
+
+    def field_of_view(self, x, y, radius=SIGHT_RADIUS):
+        """Return the frozenset of (x, y) cells visible from x,y.
+
+        Impassable terrain blocks sight (but is itself seen); entities don't.
+        Cells count as within radius by euclidean distance. Results are
+        cached per (x, y, radius) until the terrain changes.
+        """
+        if self._fov_generation != self.generation:
+            self._fields_of_view.clear()
+            self._fov_generation = self.generation
+        key = (x, y, radius)
+        visible = self._fields_of_view.pop(key, None)
+        if visible is None:
+            visible = frozenset(self._compute_field_of_view(x, y, radius))
+        self._fields_of_view[key] = visible
+        while len(self._fields_of_view) > MAX_FIELDS_OF_VIEW:
+            self._fields_of_view.popitem(last=False)
+        return visible
+
+    def can_see(self, x1, y1, x2, y2, radius=SIGHT_RADIUS):
+        """True if x2,y2 is in the field of view from x1,y1."""
+        return (x2, y2) in self.field_of_view(x1, y1, radius)
+
+    def path_heuristic(self, x1, y1, x2, y2):
+        """Octile distance: exact move cost on an open 8-connected grid."""
+        dx = abs(x1 - x2)
+        dy = abs(y1 - y2)
+        if dx > dy:
+            return dx + (SQRT2 - 1) * dy
+        return dy + (SQRT2 - 1) * dx
+
+    def distance_between(self, x1, y1, x2, y2):
+        """Estimate distance between points."""
+        # return abs(x1-x2) + abs(y1-y2) #manhattan difference
+        # real distance
+        return math.sqrt(abs((x1 - x2) ** 2) + abs((y1 - y2) ** 2))
+
+    def neighboring_tile_coords(self, x, y, traversable_only=False):
+        """Return array of neighboring coordinates."""
+        neighbors = [(x + n[0], y + n[1]) for n in
+                     ((-1, -1), (-1, 0), (-1, 1), (0, -1),
+                      (0, 1), (1, -1), (1, 0), (1, 1))]
+        if traversable_only:
+            return [n for n in neighbors if
+                    self.tile_is_traversable(n[0], n[1])]
+        else:
+            return neighbors
+
+
+class Map(BaseMap):
+
+    """Represents the game world.
+
+    Terrain is a flat bytearray of tile type ids, in row-major order. A
+    parallel bytearray holds each tile's neighbor mask (see DIRECTIONS) for
+    pathfinding.
+    """
+
+    def __init__(self, width, height, rng=None, terrain=None, neighbors=None):
+        """Create a map object. Represents a single 2d level.
+
+        rng is the random.Random used for generation and spawn points; it
+        defaults to the current world's mapgen stream.
+
+        terrain (tile type ids, row-major) starts the map with existing
+        terrain instead of all dirt. neighbors may give its already computed
+        neighbor masks (eg from afr.snapshot), which are trusted as is.
+        """
+        super(Map, self).__init__(rng)
         self.width = width
         self.height = height
         self.max_path_length = self.width * self.height  # probably too high
-        # generate an empty map
-        self.map = [[MapTile('dirt', x, y) for x in range(width)]
-                    for y in range(height)]
-        self.updateTileNeighbors()
+        # Optional afr.hpa.HierarchicalPathfinder, see
+        # enable_hierarchical_pathfinding
+        self.hierarchy = None
+        if terrain is None:
+            # generate an empty map
+            terrain = bytearray([TILE_TYPE_IDS['dirt']]) * (width * height)
+        self.terrain = bytearray(terrain)
+        if len(self.terrain) != width * height:
+            raise ValueError("Terrain has %s tiles, map needs %s" %
+                             (len(self.terrain), width * height))
+        if neighbors is None:
+            self.neighbors = bytearray(width * height)
+            self.updateTileNeighbors()
+        else:
+            self.neighbors = bytearray(neighbors)
+        self._rebuild_free_cells()
+
+    def index(self, x, y):
+        """Return the terrain array index of x,y."""
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError("Coordinates outside map")
+        return y * self.width + x
 
     def updateTileNeighbors(self):
-        """Rebuild the traversable neighbors list."""
-        for x, y in itertools.product(list(range(self.width)), list(range(self.height))):
-            node = self.getTile(x, y)
-            node.clear_neighbors()
-            # n = 0
-            for i, j in ((-1, -1), (-1, 0), (-1, 1), (0, -1),
-                         (0, 1), (1, -1), (1, 0), (1, 1)):
-                if self.tile_is_traversable(x + i, y + j):
-                    # n += 1
-                    node.neighbors.add(self.getTile(x + i, y + j))
-            # print("Added %s neighbors for %s, %s" % (n, node.x, node.y))
+        """Rebuild the neighbor masks of every tile.
+
+        Only terrain is considered; entities are checked at search time since
+        they move around.
+        """
+        if numpy is not None:
+            self._update_neighbor_masks_numpy()
+            return
+        width = self.width
+        height = self.height
+        terrain = self.terrain
+        neighbors = self.neighbors
+        for y in range(height):
+            for x in range(width):
+                mask = 0
+                for n, (i, j) in enumerate(DIRECTIONS):
+                    nx = x + i
+                    ny = y + j
+                    if 0 <= nx < width and 0 <= ny < height and \
+                            PASSABLE[terrain[ny * width + nx]]:
+                        mask |= 1 << n
+                neighbors[y * width + x] = mask
+
+    def _update_neighbor_masks_numpy(self):
+        """updateTileNeighbors, as shifted whole-array ORs."""
+        width = self.width
+        height = self.height
+        passable = numpy.frombuffer(bytes(PASSABLE), dtype=numpy.uint8)[
+            numpy.frombuffer(bytes(self.terrain), dtype=numpy.uint8)]
+        # Pad with a ring of impassable tiles so the map edge needs no
+        # special casing
+        padded = numpy.zeros((height + 2, width + 2), dtype=numpy.uint8)
+        padded[1:-1, 1:-1] = passable.reshape(height, width)
+        masks = numpy.zeros((height, width), dtype=numpy.uint8)
+        for n, (dx, dy) in enumerate(DIRECTIONS):
+            masks |= padded[1 + dy:1 + dy + height,
+                            1 + dx:1 + dx + width] << n
+        self.neighbors = bytearray(masks.tobytes())
 
     def getTile(self, x, y):
         """Return the tile at x,y."""
-        try:
-            return self.map[y][x]
-        except IndexError:
-            raise IndexError("Coordinates outside map")
+        self.index(x, y)
+        return MapTile(None, x, y, self)
+
+    def tile_type(self, x, y):
+        """Return the TileType at x,y without building a tile view."""
+        return TILE_TYPE_TABLE[self.terrain[self.index(x, y)]]
+
+    def row_icons(self, y, x1, x2):
+        """Return the icons of tiles x1 <= x < x2 on row y."""
+        self.index(x1, y)
+        self.index(x2 - 1, y)
+        start = y * self.width
+        return [ICONS[t] for t in self.terrain[start + x1:start + x2]]
 
     def setTile(self, x, y, tile):
-        """Set tile at x,y to tile.
+        """Set tile at x,y to tile (a MapTile or tile type name).
 
-        You may also want to regenerate pathfinding neighbors.
+        The neighbor masks of the surrounding tiles are updated to match, so
+        there's no need to call updateTileNeighbors afterwards.
         """
-        try:
-            self.map[y][x] = tile
-        except IndexError:
-            raise IndexError("Coordinates outside map")
+        type = tile.type if isinstance(tile, MapTile) else tile
+        i = self.index(x, y)
+        old = self.terrain[i]
+        new = TILE_TYPE_IDS[type]
+        if old == new:
+            return
+        self.terrain[i] = new
+        self.generation += 1
+        if PASSABLE[old] != PASSABLE[new]:
+            self._update_neighbor_masks(x, y, PASSABLE[new])
+            self._set_free(i, PASSABLE[new] and not self._occupied(x, y))
+            if self.hierarchy is not None:
+                self.hierarchy.tile_changed(x, y)
+
+    def _update_neighbor_masks(self, x, y, passable):
+        """Point the masks of the tiles around x,y to/away from it."""
+        width = self.width
+        height = self.height
+        neighbors = self.neighbors
+        for n, (dx, dy) in enumerate(DIRECTIONS):
+            nx = x + dx
+            ny = y + dy
+            if 0 <= nx < width and 0 <= ny < height:
+                # DIRECTIONS is symmetric, so the way back is 7 - n
+                bit = 1 << (7 - n)
+                if passable:
+                    neighbors[ny * width + nx] |= bit
+                else:
+                    neighbors[ny * width + nx] &= ~bit
+
+    def load_terrain(self, terrain):
+        """Replace the whole terrain in one step.
+
+        terrain is a sequence of tile type ids in row-major order (eg a
+        bytearray), or a height x width NumPy integer array. Neighbor masks
+        and any pathing hierarchy are rebuilt once for the lot.
+        """
+        if numpy is not None and isinstance(terrain, numpy.ndarray):
+            terrain = terrain.astype(numpy.uint8).tobytes()
+        terrain = bytearray(terrain)
+        if len(terrain) != self.width * self.height:
+            raise ValueError("Terrain has %s tiles, map needs %s" %
+                             (len(terrain), self.width * self.height))
+        self.terrain = terrain
+        self.updateTileNeighbors()
+        self._rebuild_free_cells()
+        self.generation += 1
+        if self.hierarchy is not None:
+            self.hierarchy.rebuild()
 
     def generate(self, stone_threshold=0.2):
         """Generate a random map.
 
         stone_threshold controls the probability of stone instead of dirt.
+        The noise is one draw of 16 bits per tile from self.rng, thresholded
+        with NumPy if it's available, so a seed gives the same map either
+        way.
         """
-        self.map = [[MapTile('dirt', x, y) if random.random() > stone_threshold
-                     else MapTile('stone', x, y)
-                     for x in range(self.width)] for y in range(self.height)]
-        self.updateTileNeighbors()
+        dirt = TILE_TYPE_IDS['dirt']
+        stone = TILE_TYPE_IDS['stone']
+        size = self.width * self.height
+        raw = self.rng.getrandbits(16 * size).to_bytes(2 * size, 'little')
+        threshold = stone_threshold * 0x10000
+        if numpy is not None:
+            noise = numpy.frombuffer(raw, dtype='<u2').reshape(
+                self.height, self.width)
+            self.load_terrain(numpy.where(noise > threshold, dirt, stone))
+        else:
+            noise = array.array('H')
+            noise.frombytes(raw)
+            if sys.byteorder == 'big':
+                noise.byteswap()
+            self.load_terrain(dirt if n > threshold else stone
+                              for n in noise)
 
     def generate_interior(self, rooms=2):
         """Generate connected rooms."""
-        # Generate an all-wall map
-        self.map = [[MapTile('stone', x, y) for x in range(self.width)]
-                    for y in range(self.height)]
-
-        # Add boundary
-        for x in range(self.width):
-            for y in range(self.height):
-                if x in (0, self.width - 1) or y in (0, self.height - 1):
-                    self.setTile(x, y, MapTile('boundary', x, y))
-
-        # Carve out rooms
         room_coords = []
         for room in range(rooms):
-            width = random.randint(2, 6)
-            height = random.randint(2, 6)
+            width = self.rng.randint(2, 6)
+            height = self.rng.randint(2, 6)
             # Don't let rooms overrun the map boundary
-            startx = random.randint(0, self.width - 1 - width)
-            starty = random.randint(0, self.height - 1 - height)
+            startx = self.rng.randint(0, self.width - 1 - width)
+            starty = self.rng.randint(0, self.height - 1 - height)
             endx = startx + width
             endy = starty + height
             room_coords.append((startx, starty, endx, endy))
             # logging.debug("Building room at %s,%s - %s,%s" % (startx, starty,
             #                                                   endx, endy))
-            for x in range(startx, endx):
-                for y in range(starty, endy):
-                    self.setTile(x, y, MapTile('dirt', x, y))
 
-        # Carve a tunnel between each combination of rooms
+        # A tunnel between each combination of rooms
+        tunnels = []
         for roompair in itertools.combinations(room_coords, 2):
             start_room = roompair[0]
             dest_room = roompair[1]
             if start_room != dest_room:
-                cursorx = random.randint(start_room[0], start_room[2])
-                cursory = random.randint(start_room[1], start_room[3])
-                destx = random.randint(dest_room[0], dest_room[2])
-                desty = random.randint(dest_room[1], dest_room[3])
-                self.carve_tunnel(cursorx, cursory, destx, desty)
+                cursorx = self.rng.randint(start_room[0], start_room[2])
+                cursory = self.rng.randint(start_room[1], start_room[3])
+                destx = self.rng.randint(dest_room[0], dest_room[2])
+                desty = self.rng.randint(dest_room[1], dest_room[3])
+                tunnels.append((cursorx, cursory, destx, desty))
+
+        if numpy is not None:
+            self.load_terrain(self._rasterise_numpy(room_coords, tunnels))
+        else:
+            self.load_terrain(self._rasterise(room_coords, tunnels))
 
-        # Update pathing
-        self.updateTileNeighbors()
+    def _rasterise(self, room_coords, tunnels):
+        """Return interior terrain as a bytearray, drawn a row at a time.
+
+        Tunnels follow carve_tunnel: along y1 from x1 towards x2, then along
+        x2 from y1 towards y2, stopping short of x2,y2 itself.
+        """
+        width = self.width
+        height = self.height
+        stone = TILE_TYPE_IDS['stone']
+        dirt = bytearray([TILE_TYPE_IDS['dirt']])
+        boundary = bytearray([TILE_TYPE_IDS['boundary']])
+        terrain = bytearray([stone]) * (width * height)
+
+        # Add boundary
+        terrain[:width] = boundary * width
+        terrain[-width:] = boundary * width
+        terrain[::width] = boundary * height
+        terrain[width - 1::width] = boundary * height
+
+        # Carve out rooms
+        for startx, starty, endx, endy in room_coords:
+            for y in range(starty, endy):
+                terrain[y * width + startx:y * width + endx] = \
+                    dirt * (endx - startx)
+
+        # Carve tunnels
+        for x1, y1, x2, y2 in tunnels:
+            lo, hi = (x1, x2) if x2 >= x1 else (x2 + 1, x1 + 1)
+            terrain[y1 * width + lo:y1 * width + hi] = dirt * (hi - lo)
+            lo, hi = (y1, y2) if y2 >= y1 else (y2 + 1, y1 + 1)
+            terrain[lo * width + x2:hi * width + x2:width] = dirt * (hi - lo)
+        return terrain
+
+    def _rasterise_numpy(self, room_coords, tunnels):
+        """_rasterise, as slice assignments on a NumPy array."""
+        terrain = numpy.full((self.height, self.width),
+                             TILE_TYPE_IDS['stone'], dtype=numpy.uint8)
+        dirt = TILE_TYPE_IDS['dirt']
+        boundary = TILE_TYPE_IDS['boundary']
+        terrain[0, :] = terrain[-1, :] = boundary
+        terrain[:, 0] = terrain[:, -1] = boundary
+        for startx, starty, endx, endy in room_coords:
+            terrain[starty:endy, startx:endx] = dirt
+        for x1, y1, x2, y2 in tunnels:
+            lo, hi = (x1, x2) if x2 >= x1 else (x2 + 1, x1 + 1)
+            terrain[y1, lo:hi] = dirt
+            lo, hi = (y1, y2) if y2 >= y1 else (y2 + 1, y1 + 1)
+            terrain[lo:hi, x2] = dirt
+        return terrain
 
     def carve_tunnel(self, x1, y1, x2, y2):
         """Carve a direct tunnel from x1,y1 to x2,y2."""
@@ -165,29 +674,103 @@ class Map(object):
         cursory = y1
         while cursorx != x2:
             # logging.debug("Clearing space at %s,%s" % (cursorx, cursory))
-            self.setTile(cursorx, cursory, MapTile('dirt', cursorx, cursory))
+            self.setTile(cursorx, cursory, 'dirt')
             cursorx += 1 if x2 > cursorx else -1
         while cursory != y2:
             # logging.debug("Clearing space at %s,%s" % (cursorx, cursory))
-            self.setTile(cursorx, cursory, MapTile('dirt', cursorx, cursory))
+            self.setTile(cursorx, cursory, 'dirt')
             cursory += 1 if y2 > cursory else -1
 
+    def track_occupancy(self, index):
+        """Keep tiles with blocking entities in index out of the free cells.
+
+        index is an afr.spatial.SpatialIndex; the map becomes its listener.
+        """
+        super(Map, self).track_occupancy(index)
+        self._rebuild_free_cells()
+
+    def _occupied(self, x, y):
+        return self.occupancy is not None and self.occupancy.blocked(x, y)
+
+    def _rebuild_free_cells(self):
+        """Recompute the list of passable, unoccupied tiles."""
+        terrain = self.terrain
+        self._free = [i for i in range(len(terrain))
+                      if PASSABLE[terrain[i]]]
+        if self.occupancy is not None:
+            occupied = set(y * self.width + x
+                           for x, y in self.occupancy.blockers
+                           if 0 <= x < self.width and 0 <= y < self.height)
+            self._free = [i for i in self._free if i not in occupied]
+        # terrain index -> position in self._free, or -1
+        self._free_pos = array.array('i', [-1]) * len(terrain)
+        for pos, i in enumerate(self._free):
+            self._free_pos[i] = pos
+
+    def _set_free(self, i, free):
+        """Add or remove terrain index i from the free cells."""
+        pos = self._free_pos[i]
+        if free and pos < 0:
+            self._free_pos[i] = len(self._free)
+            self._free.append(i)
+        elif not free and pos >= 0:
+            # Swap the last free cell into the hole
+            last = self._free.pop()
+            if last != i:
+                self._free[pos] = last
+                self._free_pos[last] = pos
+            self._free_pos[i] = -1
+
+    def cell_blocked(self, x, y):
+        """Spatial index callback: a blocking entity arrived at x,y."""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self._set_free(y * self.width + x, False)
+
+    def cell_unblocked(self, x, y):
+        """Spatial index callback: the last blocking entity left x,y."""
+        if 0 <= x < self.width and 0 <= y < self.height:
+            i = y * self.width + x
+            self._set_free(i, PASSABLE[self.terrain[i]])
+
+    def free_cells(self):
+        """Return the free cell terrain indices as an array, in order."""
+        return array.array('i', self._free)
+
+    def load_free_cells(self, cells):
+        """Restore the order of the free cells from free_cells.
+
+        cells must hold exactly the current free cells; the order matters
+        only to which cells later random picks return.
+        """
+        cells = list(cells)
+        if sorted(cells) != sorted(self._free):
+            raise ValueError("Free cells don't match the map")
+        self._free = cells
+        for pos, i in enumerate(cells):
+            self._free_pos[i] = pos
+
+    def free_cell_count(self):
+        """Return how many tiles are passable and unoccupied."""
+        return len(self._free)
+
     def get_empty_coordinates(self):
         """Return a random traversable tile.
 
-
-        XXX: this method is REALLLLLLY unoptimised.
+        Picks from the free cells, so it's O(1). Occupancy is only known once
+        track_occupancy has been called.
         """
-        tries = 0
-        x = random.randint(0, self.width - 1)
-        y = random.randint(0, self.height - 1)
-        while not self.tile_is_traversable(x, y):
-            if tries > (self.max_path_length * 10):
-                raise RuntimeError("Failed to find empty coordinates!")
-            x = random.randint(0, self.width - 1)
-            y = random.randint(0, self.height - 1)
-            tries += 1
-        return (x, y)
+        if not self._free:
+            raise RuntimeError("Failed to find empty coordinates!")
+        i = self._free[self.rng.randrange(len(self._free))]
+        return (i % self.width, i // self.width)
+
+    def get_many_empty_coordinates(self, count):
+        """Return a list of count distinct random traversable tiles."""
+        if count > len(self._free):
+            raise RuntimeError("Only %s empty coordinates, wanted %s!" %
+                               (len(self._free), count))
+        return [(i % self.width, i // self.width)
+                for i in self.rng.sample(self._free, count)]
 
     def pathfind(self, x1, y1, x2, y2):
         """Return array of tiles which are a path between x1,y1 and x2,y2.
@@ -195,81 +778,112 @@ class Map(object):
         returns False if there is no path.
         A path of [] will be returned if you're already at the destination.
         """
-        # thanks to
-        # http://scriptogr.am/jdp/post/pathfinding-with-python-graphs-and-a-star
-        start = self.getTile(x1, y1)
-        end = self.getTile(x2, y2)
-
-        openset = set()
-        closedset = set()
-        current = start
-        openset.add(current)
+        path = None
+        if self.hierarchy is not None and \
+                max(abs(x1 - x2), abs(y1 - y2)) > self.hierarchy.cluster_size:
+            path = self.hierarchy.pathfind(x1, y1, x2, y2)
+        else:
+            path = self._astar(x1, y1, x2, y2)
+        if path is None:
+            # Maybe return a partial path in future.
+            logging.warning("Cound't find path!")
+            return None
+        width = self.width
+        return [MapTile(None, i % width, i // width, self) for i in path]
+
+    def _astar(self, x1, y1, x2, y2, bounds=None, avoid_entities=True):
+        """Return terrain indices of a path from x1,y1 to x2,y2, or None.
+
+        bounds=(minx, miny, maxx, maxy) (inclusive) confines the search to a
+        rectangle. avoid_entities=False ignores entities blocking the way.
+        """
+        # Search state lives in these per-query dicts, keyed by terrain
+        # index, rather than on the tiles themselves.
+        width = self.width
+        start = self.index(x1, y1)
+        end = self.index(x2, y2)
+        neighbors = self.neighbors
+        blocked = afr.entity.spatial.blocked
+        g = {start: 0}
         parent = {}
+        closedset = set()
+        # Open list entries are (f, h, seq, index). Ties on f prefer the node
+        # nearer the goal, then the one queued first.
+        seq = itertools.count()
+        h = self.path_heuristic(x1, y1, x2, y2)
+        openheap = [(h, h, next(seq), start)]
         cycles = 0
-        while openset:
+        while openheap:
+            current = heapq.heappop(openheap)[3]
+            if current in closedset:
+                continue  # stale entry superseded by a cheaper one
             cycles += 1
-            current = min(openset, key=lambda t: t.g + t.h)
             if current == end:
+                self.nodes_expanded += cycles
                 path = []
                 while current in parent:
                     path.append(current)
                     current = parent[current]
-                path.append(current)
                 logging.debug("Found path for %s,%s to %s,%s in %s cycles "
                               "(%s steps)", x1, y1, x2, y2,
-                              cycles, len(path) - 1)
-                return path[-2::-1]  # [::-1] to include current tile
-            openset.remove(current)
+                              cycles, len(path))
+                return path[::-1]
             closedset.add(current)
-            for node in self.getTile(current.x, current.y).neighbors:
-                if not self.tile_is_traversable(node.x, node.y):
-                    if node.x != x2 or node.y != y2:
-                        closedset.add(node)
+            current_g = g[current]
+            cy, cx = divmod(current, width)
+            mask = neighbors[current]
+            for n, (dx, dy) in enumerate(DIRECTIONS):
+                if not mask & (1 << n):
+                    continue
+                node = current + dy * width + dx
                 if node in closedset:
                     continue
-                if node in openset:
-                    new_g = current.g + current.move_cost(node)
-                    if node.g > new_g:
-                        node.g = new_g
-                        parent[node] = current
-                else:
-                    node.g = current.g + current.move_cost(node)
-                    node.h = self.distance_between(node.x, node.y,
-                                                   end.x, end.y)
+                nx = cx + dx
+                ny = cy + dy
+                if bounds is not None and \
+                        not (bounds[0] <= nx <= bounds[2] and
+                             bounds[1] <= ny <= bounds[3]):
+                    continue
+                if avoid_entities and node != end and blocked(nx, ny):
+                    closedset.add(node)
+                    continue
+                new_g = current_g + (SQRT2 if dx and dy else 1)
+                if new_g < g.get(node, new_g + 1):
+                    g[node] = new_g
                     parent[node] = current
-                    openset.add(node)
+                    h = self.path_heuristic(nx, ny, x2, y2)
+                    heapq.heappush(openheap, (new_g + h, h, next(seq), node))
         # If we're here, we didn't find a path.
-        # Maybe return a partial path in future.
-        logging.warning("Cound't find path!")
+        self.nodes_expanded += cycles
         return None
 
-    def distance_between(self, x1, y1, x2, y2):
-        """Estimate distance between points."""
-        # return abs(x1-x2) + abs(y1-y2) #manhattan difference
-        # real distance
-        return math.sqrt(abs((x1 - x2) ** 2) + abs((y1 - y2) ** 2))
+    def enable_hierarchical_pathfinding(self, cluster_size=16):
+        """Route long paths through an HPA* abstraction of the map.
+
+        pathfind will search the abstract graph for any trip longer than
+        cluster_size tiles. Pass cluster_size=None to switch back to plain A*.
+        """
+        if cluster_size is None:
+            self.hierarchy = None
+        else:
+            self.hierarchy = afr.hpa.HierarchicalPathfinder(self,
+                                                            cluster_size)
+
+    def _compute_field_of_view(self, x, y, radius):
+        """Return the set of cells visible from x,y, uncached."""
+        self.index(x, y)
+        return shadowcast(self.terrain, self.width, self.height, x, y,
+                          radius)
 
     def tile_is_traversable(self, x, y):
         """True if given tile is traversable."""
         return 0 <= x < self.width and 0 <= y < self.height and \
-            self.getTile(x, y).tile.passable and \
-            not any([e.blocks_movement and e.x == x and e.y == y
-                     for e in afr.entity.entities
-                     if e.has_component('corporeal')])
-
-    def neighboring_tile_coords(self, x, y, traversable_only=False):
-        """Return array of neighboring coordinates."""
-        neighbors = [(x + n[0], y + n[1]) for n in
-                     ((-1, -1), (-1, 0), (-1, 1), (0, -1),
-                      (0, 1), (1, -1), (1, 0), (1, 1))]
-        if traversable_only:
-            return [n for n in neighbors if
-                    self.tile_is_traversable(n[0], n[1])]
-        else:
-            return neighbors
+            PASSABLE[self.terrain[y * self.width + x]] and \
+            not afr.entity.spatial.blocked(x, y)
 
 
 def CreateMap(**kwargs):
     """Helper function to create the map."""
     global map
     map = Map(**kwargs)
+    map.track_occupancy(afr.entity.spatial)
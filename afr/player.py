@@ -20,8 +20,14 @@ KEY_MAP = {
     'i': 'show-inventory',
     '.': 'wait',
     'e': 'equip',
+    '>': 'use-stairs',
+    '<': 'use-stairs',
 }
 
+# Asks the player a follow-up question (eg which item) and returns the answer
+# string. Recorders and replays (see afr.replay) swap it out.
+prompt = input
+
 
 class ActionError(Exception):
 
@@ -74,11 +80,11 @@ def _do_pickup(action, entity):
     elif len(items) == 1:
         item_num = 0
     else:
-        prompt = "Pick up which item?\n"
+        question = "Pick up which item?\n"
         for i in range(len(items)):
-            prompt += '%s: %s\n' % (i, items[i])
-        prompt += '\n'
-        item_num = input(prompt)
+            question += '%s: %s\n' % (i, items[i])
+        question += '\n'
+        item_num = prompt(question)
         try:
             item_num = int(item_num)
         except:
@@ -103,11 +109,11 @@ def _do_wait(action, entity):
 def _do_equip(action, entity):
     if len(entity.inventory) < 1:
         raise ActionError("Your inventory is empty!")
-    prompt = "Equip which item?\n"
+    question = "Equip which item?\n"
     for i in range(len(entity.inventory)):
-        prompt += '%s: %s\n' % (i, entity.inventory[i])
-    prompt += '\n'
-    item_num = input(prompt)
+        question += '%s: %s\n' % (i, entity.inventory[i])
+    question += '\n'
+    item_num = prompt(question)
     try:
         item_num = int(item_num)
     except:
@@ -121,6 +127,12 @@ def _do_equip(action, entity):
         raise ActionError("Couldn't equip %s." % item.name)
 
 
+def _do_stairs(action, entity):
+    # Stairs lead to other levels, which only afr.levels knows about; it
+    # handles this action itself before it gets here.
+    raise ActionError("There are no stairs here.")
+
+
 def handle_player_action(action, entity):
     """Resolve player action."""
     # XXX: this action -> func mapping should probably be defined in the
@@ -137,16 +149,14 @@ def handle_player_action(action, entity):
         func = _do_wait
     elif action == 'equip':
         func = _do_equip
+    elif action == 'use-stairs':
+        func = _do_stairs
     else:
         logging.warning("Unknown player action %s!", action)
         return False
 
-    logging.debug(
-        "Player action calls {func} with args action={action} "
-        "entity={entity}".format(
-            func=func,
-            action=action,
-            entity=entity))
+    logging.debug("Player action calls %s with args action=%s entity=%s",
+                  func, action, entity)
 
     try:
         func(action, entity)
@@ -0,0 +1,231 @@
+"""Opt-in instrumentation of the game's hot paths.
+
+enable() wraps game.tick, AI.run_ai, the pathfind and tile_is_traversable
+of Map and ChunkedMap, BaseMap.flow_field, BaseMap.field_of_view and
+screen.draw_map with timers and counters; disable() puts the originals
+back. Nothing is wrapped until then, so there's no cost when profiling is
+off.
+
+    profiler = afr.profiling.enable(afr.profiling.Profiler(
+        stream=open('profile.json', 'w'), every=100))
+    ... run ticks ...
+    afr.profiling.disable()
+
+Every `every` ticks the aggregates so far are written to stream as one JSON
+line and reset. A cProfile capture can be run over a window of ticks too.
+"""
+
+import cProfile
+import json
+import time
+
+import afr.chunkedmap
+import afr.entity
+import afr.game
+import afr.map
+import afr.screen
+from afr.entitycomponents.ai import AI
+
+# (owner, attribute, timer name) of everything enable() wraps
+TARGETS = (
+    (afr.game, 'tick', 'tick'),
+    (AI, 'run_ai', 'run_ai'),
+    (afr.map.Map, 'pathfind', 'pathfind'),
+    (afr.map.BaseMap, 'flow_field', 'flow_field'),
+    (afr.map.BaseMap, 'field_of_view', 'field_of_view'),
+    (afr.map.Map, 'tile_is_traversable', 'tile_is_traversable'),
+    (afr.chunkedmap.ChunkedMap, 'pathfind', 'pathfind'),
+    (afr.chunkedmap.ChunkedMap, 'tile_is_traversable', 'tile_is_traversable'),
+    (afr.screen, 'draw_map', 'draw_map'),
+)
+
+# The enabled Profiler, if any
+active = None
+# (owner, attribute, original) for everything currently wrapped
+_originals = []
+
+
+class Profiler(object):
+
+    """Timers and counters collected while enabled.
+
+    timers maps name -> [calls, seconds]; counters maps name -> total. Both
+    cover the ticks since the last reset.
+    """
+
+    def __init__(self, stream=None, every=None, cprofile_window=None,
+                 cprofile_path='afr.prof'):
+        """Create a profiler.
+
+        stream (a text file) receives a JSON report every `every` ticks.
+        cprofile_window=(start, stop) runs cProfile from after tick start
+        until after tick stop and dumps its stats to cprofile_path.
+        """
+        self.stream = stream
+        self.every = every
+        self.cprofile_window = cprofile_window
+        self.cprofile_path = cprofile_path
+        self.timers = {}
+        self.counters = {}
+        # Ticks since the last reset, and in total
+        self.ticks = 0
+        self.total_ticks = 0
+        self._cprofile = None
+
+    def timer(self, name):
+        """Return the [calls, seconds] list for name."""
+        return self.timers.setdefault(name, [0, 0.0])
+
+    def count(self, name, n=1):
+        """Add n to counter name."""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """Return the aggregates since the last reset as a dict."""
+        timers = {}
+        for name, (calls, seconds) in self.timers.items():
+            if calls:
+                timers[name] = {'calls': calls, 'seconds': seconds,
+                                'mean': seconds / calls}
+        return {
+            'first_tick': self.total_ticks - self.ticks + 1,
+            'ticks': self.ticks,
+            'timers': timers,
+            'counters': dict(self.counters),
+        }
+
+    def reset(self):
+        """Zero every timer and counter."""
+        for timer in self.timers.values():
+            timer[0] = 0
+            timer[1] = 0.0
+        self.counters.clear()
+        self.ticks = 0
+
+    def export(self):
+        """Write report() to stream as a JSON line, then reset."""
+        if self.stream is not None and self.ticks:
+            self.stream.write(json.dumps(self.report(), sort_keys=True) +
+                              '\n')
+            self.stream.flush()
+        self.reset()
+
+    def tick_done(self):
+        """Called after every game tick."""
+        self.ticks += 1
+        self.total_ticks += 1
+        if self.cprofile_window is not None:
+            start, stop = self.cprofile_window
+            if self.total_ticks == start:
+                self.start_cprofile()
+            elif self.total_ticks == stop:
+                self.stop_cprofile()
+        if self.every and self.ticks >= self.every:
+            self.export()
+
+    def start_cprofile(self):
+        """Start the cProfile capture."""
+        if self._cprofile is None:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop_cprofile(self):
+        """Stop the cProfile capture and dump it to cprofile_path."""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.cprofile_path)
+            self._cprofile = None
+
+
+def _timed(func, timer):
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += time.perf_counter() - start
+    return timed
+
+
+def _timed_tick(func, profiler):
+    timed = _timed(func, profiler.timer('tick'))
+
+    def tick(*args, **kwargs):
+        try:
+            return timed(*args, **kwargs)
+        finally:
+            profiler.tick_done()
+    return tick
+
+
+def _timed_pathfind(func, profiler):
+    timed = _timed(func, profiler.timer('pathfind'))
+
+    def pathfind(self, *args, **kwargs):
+        expanded = self.nodes_expanded
+        path = timed(self, *args, **kwargs)
+        profiler.count('pathfind.nodes_expanded',
+                       self.nodes_expanded - expanded)
+        if path is None:
+            profiler.count('pathfind.failed')
+        else:
+            profiler.count('pathfind.path_length', len(path))
+        return path
+    return pathfind
+
+
+def _rebind_run_ai():
+    """Point the current world's AI entities at AI.run_ai as it is now.
+
+    Entities copy exported methods when the component is attached, so they
+    wouldn't see the class being patched otherwise.
+    """
+    for e in afr.entity.registry.query(['ai']):
+        e.run_ai = e.components['ai'].run_ai
+
+
+def enable(profiler=None):
+    """Start profiling into profiler (a new Profiler by default).
+
+    Returns the profiler.
+    """
+    global active
+    if active is not None:
+        disable()
+    if profiler is None:
+        profiler = Profiler()
+    for owner, attribute, name in TARGETS:
+        original = getattr(owner, attribute)
+        if attribute == 'tick':
+            wrapped = _timed_tick(original, profiler)
+        elif attribute == 'pathfind':
+            wrapped = _timed_pathfind(original, profiler)
+        else:
+            wrapped = _timed(original, profiler.timer(name))
+        _originals.append((owner, attribute, original))
+        setattr(owner, attribute, wrapped)
+    _rebind_run_ai()
+    active = profiler
+    if profiler.cprofile_window is not None and \
+            profiler.cprofile_window[0] == 0:
+        profiler.start_cprofile()
+    return profiler
+
+
+def disable():
+    """Stop profiling and restore the unwrapped functions.
+
+    Returns the profiler that was active, after exporting what it has left.
+    """
+    global active
+    profiler = active
+    while _originals:
+        owner, attribute, original = _originals.pop()
+        setattr(owner, attribute, original)
+    _rebind_run_ai()
+    active = None
+    if profiler is not None:
+        profiler.stop_cprofile()
+        profiler.export()
+    return profiler
@@ -0,0 +1,77 @@
+"""Index of entities by the components attached to them.
+
+Lets systems ask for "every entity with ai and corporeal but not player"
+without filtering the whole entity store with has_component.
+"""
+
+
+class ComponentRegistry(object):
+
+    """Tracks which entities have which components.
+
+    Entity.attach_component/detach_component keep it up to date. Besides one
+    member table per component name, every distinct query asked for is kept
+    as its own table and updated incrementally from then on.
+
+    Member tables are dicts used as insertion-ordered sets, so iteration
+    order (and with it the order entities act in) doesn't depend on object
+    ids and a seeded run replays identically.
+    """
+
+    def __init__(self):
+        """Create an empty registry."""
+        # component name -> {entity: None} of entities with it
+        self.by_component = {}
+        # (frozenset(include), frozenset(exclude)) -> {entity: None}
+        self.queries = {}
+
+    def attached(self, entity, name):
+        """Record that component name was attached to entity."""
+        self.by_component.setdefault(name, {})[entity] = None
+        self._update_queries(entity, name)
+
+    def detached(self, entity, name):
+        """Record that component name was detached from entity."""
+        self.by_component.get(name, {}).pop(entity, None)
+        self._update_queries(entity, name)
+
+    def _update_queries(self, entity, name):
+        for (include, exclude), members in self.queries.items():
+            if name in include or name in exclude:
+                if self._matches(entity, include, exclude):
+                    members[entity] = None
+                else:
+                    members.pop(entity, None)
+
+    def _matches(self, entity, include, exclude):
+        components = entity.components
+        for c in include:
+            if c not in components:
+                return False
+        for c in exclude:
+            if c in components:
+                return False
+        return True
+
+    def query(self, include, exclude=()):
+        """Return a list of entities with all of include and none of exclude.
+
+        The result is a copy, so components may be attached/detached while
+        iterating over it. Queries with an empty include aren't cached: any
+        attach or detach could change them, so they're rebuilt every time.
+        """
+        key = (frozenset(include), frozenset(exclude))
+        if not key[0]:
+            everyone = {}
+            for table in self.by_component.values():
+                everyone.update(table)
+            return [e for e in everyone if self._matches(e, (), key[1])]
+        members = self.queries.get(key)
+        if members is None:
+            # Start from the rarest component and filter that down
+            smallest = min((self.by_component.get(c, {}) for c in key[0]),
+                           key=len)
+            members = dict((e, None) for e in smallest
+                           if self._matches(e, key[0], key[1]))
+            self.queries[key] = members
+        return list(members)
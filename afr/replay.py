@@ -0,0 +1,230 @@
+"""Recording and replaying games.
+
+A game is fully determined by its world seed, the world's build arguments
+and the player's input, so that's all a recording holds. The log is text:
+a JSON header line, then one line per game.tick call with the action's key
+(see player.KEY_MAP, '-' for an AI turn) followed by any answers given to
+player.prompt as a JSON list. Lines starting with '=' are checkpoints holding
+the tick count and a hash of the game state, which replays check to catch
+desyncs. Replays run headless at full speed:
+
+    python -m afr.replay game.log
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import time
+
+import afr.entity
+import afr.map
+import afr.rng
+import afr.scheduler
+from afr import game
+from afr import player
+from afr import simulation
+
+FORMAT = 'afr-replay'
+VERSION = 1
+# Ticks between recorded state hashes
+CHECKPOINT_EVERY = 100
+NO_ACTION = '-'
+
+ACTION_KEYS = dict((action, key) for key, action in player.KEY_MAP.items())
+
+
+class ReplayError(Exception):
+
+    """Raised when a log can't be read or the replay desyncs from it."""
+
+    pass
+
+
+def state_hash():
+    """Return a hex digest of the current world's game state.
+
+    Covers terrain, entity positions and health, the random streams and the
+    scheduler clock; enough to notice a replay going its own way.
+    """
+    h = hashlib.sha1()
+    m = afr.map.map
+    if m.width is None:
+        # Chunked maps regenerate identically; changes bump the generation
+        h.update(repr(m.generation).encode('utf-8'))
+    else:
+        h.update(m.terrain)
+    for e in afr.entity.registry.query(()):
+        h.update(repr((e.name, getattr(e, 'x', None), getattr(e, 'y', None),
+                       getattr(e, 'current_hp', None),
+                       getattr(e, 'alive', None))).encode('utf-8'))
+    h.update(repr(sorted(afr.rng.streams.getstate().items()))
+             .encode('utf-8'))
+    h.update(repr(afr.scheduler.scheduler.time).encode('utf-8'))
+    return h.hexdigest()
+
+
+class Recorder(object):
+
+    """Writes a log of the game played through its tick method."""
+
+    def __init__(self, stream, seed, world_args,
+                 checkpoint_every=CHECKPOINT_EVERY):
+        """Start a log on stream, a text file open for writing.
+
+        seed and world_args (see simulation.build_world) must be what the
+        world being played was built with.
+        """
+        self.stream = stream
+        self.checkpoint_every = checkpoint_every
+        self.ticks = 0
+        stream.write(json.dumps({'format': FORMAT, 'version': VERSION,
+                                 'seed': seed, 'world': world_args},
+                                sort_keys=True) + '\n')
+
+    def tick(self, action):
+        """Run game.tick(action), recording the action and any prompts.
+
+        Raises ValueError, without running the tick, if action has no key
+        to record it by.
+        """
+        if action is not None and action not in ACTION_KEYS:
+            raise ValueError("Can't record unknown action %r" % action)
+        answers = []
+        ask = player.prompt
+
+        def recording_prompt(question):
+            answer = ask(question)
+            answers.append(answer)
+            return answer
+
+        player.prompt = recording_prompt
+        try:
+            return game.tick(action)
+        finally:
+            player.prompt = ask
+            self._write(action, answers)
+
+    def _write(self, action, answers):
+        line = ACTION_KEYS[action] if action is not None else NO_ACTION
+        if answers:
+            line += ' ' + json.dumps(answers)
+        self.stream.write(line + '\n')
+        self.ticks += 1
+        if self.checkpoint_every and not self.ticks % self.checkpoint_every:
+            self.stream.write('=%s %s\n' % (self.ticks, state_hash()))
+        self.stream.flush()
+
+
+def read_log(stream):
+    """Return (header, entries) from a log.
+
+    entries is a list of ('tick', action, answers) and
+    ('checkpoint', ticks, hash) tuples in log order.
+    """
+    try:
+        header = json.loads(stream.readline())
+    except ValueError:
+        raise ReplayError("Log has no header")
+    if header.get('format') != FORMAT or header.get('version') != VERSION:
+        raise ReplayError("Not a version %s %s log" % (VERSION, FORMAT))
+    entries = []
+    for n, line in enumerate(stream, 2):
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        if line.startswith('='):
+            ticks, digest = line[1:].split(' ')
+            entries.append(('checkpoint', int(ticks), digest))
+            continue
+        key, _, answers = line.partition(' ')
+        if key == NO_ACTION:
+            action = None
+        elif key in player.KEY_MAP:
+            action = player.KEY_MAP[key]
+        else:
+            raise ReplayError("Unknown key %r on line %s" % (key, n))
+        entries.append(('tick', action, json.loads(answers) if answers
+                        else []))
+    return header, entries
+
+
+def replay(stream, verify=True):
+    """Replay a log headless. Return a dict describing the run.
+
+    With verify, every checkpoint's state hash is compared and ReplayError
+    raised at the first mismatch.
+    """
+    header, entries = read_log(stream)
+    answers = []
+
+    def replay_prompt(question):
+        if not answers:
+            raise ReplayError("Log has no answer for prompt %r" % question)
+        return answers.pop(0)
+
+    ask = player.prompt
+    player.prompt = replay_prompt
+    try:
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            start = time.time()
+            w, p = simulation.build_world(seed=header['seed'],
+                                          **header['world'])
+            built = time.time()
+            ticks = 0
+            outcome = 'end of log'
+            checkpoints = 0
+            for entry in entries:
+                if entry[0] == 'checkpoint':
+                    if verify:
+                        digest = state_hash()
+                        if digest != entry[2]:
+                            raise ReplayError(
+                                "Desync at tick %s: state hash %s, log has "
+                                "%s" % (entry[1], digest, entry[2]))
+                        checkpoints += 1
+                    continue
+                action = entry[1]
+                if action == 'quit-game':
+                    outcome = 'quit'
+                    break
+                answers[:] = entry[2]
+                ticks += 1
+                try:
+                    game.tick(action)
+                except game.GameOver:
+                    outcome = 'player died'
+                    break
+            end = time.time()
+    finally:
+        player.prompt = ask
+    return {
+        'seed': header['seed'],
+        'ticks': ticks,
+        'outcome': outcome,
+        'checkpoints_verified': checkpoints,
+        'player_hp': p.current_hp,
+        'build_seconds': built - start,
+        'seconds': end - built,
+        'ticks_per_second': ticks / (end - built) if end > built else None,
+    }
+
+
+def main():
+    """Command line entry point: replay a log and print the result."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('log', help='log written by a Recorder')
+    parser.add_argument('--no-verify', action='store_true',
+                        help="don't check state hashes at checkpoints")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR,
+                        format="%(filename)s (%(funcName)s) %(message)s")
+    with open(args.log) as f:
+        print(json.dumps(replay(f, verify=not args.no_verify),
+                         sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Seeded random number streams.
+
+A world has one seed. Each subsystem draws from its own stream derived from
+that seed, so runs are reproducible and e.g. an extra AI decision doesn't
+shift every later combat roll. Game code uses the current world's streams
+through the module global afr.rng.streams unless handed one explicitly.
+"""
+
+import random
+
+STREAM_NAMES = ('mapgen', 'ai', 'combat')
+
+
+class Streams(object):
+
+    """A random.Random per name in STREAM_NAMES, derived from one seed."""
+
+    def __init__(self, seed=None):
+        """Create the streams. seed=None picks a random seed."""
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        for name in STREAM_NAMES:
+            # str seeds are hashed with sha512, so they're stable across
+            # runs and platforms
+            setattr(self, name, random.Random('%s:%s' % (seed, name)))
+
+    def getstate(self):
+        """Return {name: state} of every stream."""
+        return dict((name, getattr(self, name).getstate())
+                    for name in STREAM_NAMES)
+
+    def setstate(self, state):
+        """Restore states from getstate."""
+        for name in STREAM_NAMES:
+            getattr(self, name).setstate(state[name])
+
+# Streams of the current world
+streams = Streams()
@@ -0,0 +1,122 @@
+"""Energy/speed based turn scheduling.
+
+Entities act in order of when their next action is due rather than all once
+per turn. An entity with speed s waits TURN * NORMAL_SPEED / s time units
+between actions, so faster creatures act more often. Entities that have
+nothing to do (eg the dead, or sleeping monsters) can be parked: they cost
+nothing until something wakes them.
+
+The AI component schedules its owner when attached. Game code uses the
+current world's scheduler through the module global afr.scheduler.scheduler.
+"""
+
+import heapq
+import itertools
+
+# Time units in one game turn (one tick of afr.game.tick)
+TURN = 100
+NORMAL_SPEED = 100
+
+
+def action_delay(entity):
+    """Return the time entity needs between actions, based on its speed."""
+    speed = entity.get('speed') if hasattr(entity, 'speed') else NORMAL_SPEED
+    if speed <= 0:
+        return None
+    return max(1, TURN * NORMAL_SPEED // speed)
+
+
+class Scheduler(object):
+
+    """Priority queue of entities keyed by the time of their next action.
+
+    Ties are broken by scheduling order, so runs are repeatable. Cancelled
+    entries are left in the heap and skipped when they come up.
+    """
+
+    def __init__(self):
+        """Create an empty scheduler at time 0."""
+        self.time = 0
+        # (due time, sequence number, entity)
+        self.queue = []
+        # entity -> sequence number of its live queue entry
+        self.entries = {}
+        # entities waiting for wake; dict for a stable order
+        self.parked = {}
+        self._seq = itertools.count()
+
+    def __contains__(self, entity):
+        """True if entity is scheduled or parked."""
+        return entity in self.entries or entity in self.parked
+
+    def __len__(self):
+        """Number of entities scheduled to act."""
+        return len(self.entries)
+
+    def pending(self):
+        """Return [(due time, entity)] of scheduled actions in run order."""
+        return [(due, entity) for due, seq, entity in sorted(self.queue)
+                if self.entries.get(entity) == seq]
+
+    def schedule(self, entity, delay=0):
+        """(Re)schedule entity to act delay time units from now."""
+        self.parked.pop(entity, None)
+        seq = next(self._seq)
+        self.entries[entity] = seq
+        heapq.heappush(self.queue, (self.time + delay, seq, entity))
+
+    def unschedule(self, entity):
+        """Forget entity, scheduled or parked."""
+        self.entries.pop(entity, None)
+        self.parked.pop(entity, None)
+
+    def park(self, entity):
+        """Stop entity acting until it is woken."""
+        if entity in self.entries:
+            del(self.entries[entity])
+            self.parked[entity] = None
+
+    def wake(self, entity, delay=0):
+        """Schedule a parked entity again. Does nothing otherwise."""
+        if entity in self.parked:
+            self.schedule(entity, delay)
+
+    def skip(self, duration):
+        """Move the clock on duration without anyone acting.
+
+        Pending actions move along with it, keeping their order.
+        """
+        self.time += duration
+        # Adding the same to every key keeps the heap a heap
+        self.queue = [(due + duration, seq, entity)
+                      for due, seq, entity in self.queue]
+
+    def advance(self, duration=TURN):
+        """Run every action due in the next duration time units.
+
+        Each entity due acts through its run_ai, then is rescheduled after
+        its action delay, or parked if it's dead or can't act.
+        """
+        end = self.time + duration
+        queue = self.queue
+        entries = self.entries
+        while queue and queue[0][0] < end:
+            due, seq, entity = heapq.heappop(queue)
+            if entries.get(entity) != seq:
+                continue  # cancelled or rescheduled since
+            self.time = due
+            entity.run_ai()
+            if entries.get(entity) != seq:
+                continue  # run_ai rescheduled or removed it
+            delay = action_delay(entity) if getattr(entity, 'alive', True) \
+                else None
+            if delay is None:
+                self.park(entity)
+            else:
+                seq = next(self._seq)
+                entries[entity] = seq
+                heapq.heappush(queue, (due + delay, seq, entity))
+        self.time = end
+
+# Scheduler of the current world
+scheduler = Scheduler()
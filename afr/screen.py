@@ -1,6 +1,7 @@
 """Handles display of the game."""
 
 import logging
+import sys
 
 import afr.entity
 import afr.util
@@ -8,62 +9,124 @@ import afr.util
 CAMERA_TILES_X = 20
 CAMERA_TILES_Y = 20
 
+# ANSI escape sequences
+CLEAR_SCREEN = '\x1b[2J'
+MOVE_CURSOR = '\x1b[{row};{col}H'
 
-def draw_map(m, focus=None, clamp_to_map=True):
-    """Draw the map."""
-    # This is our buffer.
-    new_screen = [[' ' for j in range(CAMERA_TILES_Y)]
-                  for i in range(CAMERA_TILES_X)]
+
+class DiffRenderer(object):
+
+    """Double-buffered terminal output.
+
+    Keeps the last frame it wrote and sends only the runs of cells that have
+    changed since, as ANSI cursor moves plus text, in a single write.
+    """
+
+    def __init__(self, stream=None):
+        """Render to stream (default stdout), eg a terminal or a pipe."""
+        self.stream = stream if stream is not None else sys.stdout
+        self.previous = None
+
+    def invalidate(self):
+        """Force a full redraw next frame (eg after other output)."""
+        self.previous = None
+
+    def render(self, frame):
+        """Write frame, a list of equal length row strings."""
+        previous = self.previous
+        out = []
+        if previous is None or len(previous) != len(frame) or \
+                any(len(a) != len(b) for a, b in zip(previous, frame)):
+            out.append(CLEAR_SCREEN)
+            for y, row in enumerate(frame):
+                out.append(MOVE_CURSOR.format(row=y + 1, col=1))
+                out.append(row)
+        else:
+            for y, (old, new) in enumerate(zip(previous, frame)):
+                if old == new:
+                    continue
+                x = 0
+                width = len(new)
+                while x < width:
+                    if old[x] == new[x]:
+                        x += 1
+                        continue
+                    start = x
+                    while x < width and old[x] != new[x]:
+                        x += 1
+                    out.append(MOVE_CURSOR.format(row=y + 1, col=start + 1))
+                    out.append(new[start:x])
+        # Park the cursor below the map
+        out.append(MOVE_CURSOR.format(row=len(frame) + 1, col=1))
+        self.stream.write(''.join(out))
+        self.stream.flush()
+        self.previous = frame
+
+
+def draw_map(m, focus=None, clamp_to_map=True, renderer=None, visible=None):
+    """Draw the map.
+
+    Without a renderer the whole frame is written to stdout in one go. Pass a
+    DiffRenderer to send only what changed since its last frame.
+
+    visible is an optional set of (x, y) cells (see Map.field_of_view); if
+    given, everything else is left blank.
+    """
+    startx = 0
+    starty = 0
     # If we have a focus, ensure it's in the midle of the screen
     if focus:
         half_x = CAMERA_TILES_X // 2
         half_y = CAMERA_TILES_Y // 2
         startx = focus.x - half_x
         starty = focus.y - half_y
-    # Clamp draw rectangle to map border
-    if clamp_to_map:
-        if startx + CAMERA_TILES_X > m.width:
-            startx = m.width - CAMERA_TILES_X
-        if starty + CAMERA_TILES_Y > m.height:
-            starty = m.height - CAMERA_TILES_Y
+    if m.width is None:
+        # Chunked maps (see afr.chunkedmap) have no edges
+        firstx = startx
+        firsty = starty
+        endx = startx + CAMERA_TILES_X
+        endy = starty + CAMERA_TILES_Y
+    else:
+        # Clamp draw rectangle to map border
+        if clamp_to_map:
+            if startx + CAMERA_TILES_X > m.width:
+                startx = m.width - CAMERA_TILES_X
+            if starty + CAMERA_TILES_Y > m.height:
+                starty = m.height - CAMERA_TILES_Y
 
-        startx = 0 if startx < 0 else startx
-        starty = 0 if starty < 0 else starty
+            startx = 0 if startx < 0 else startx
+            starty = 0 if starty < 0 else starty
 
-    # Don't try to draw tiles beyond the edge of the map
-    endx = max([min([startx + CAMERA_TILES_X, m.width]), 0])
-    endy = max([min([starty + CAMERA_TILES_Y, m.height]), 0])
+        # Don't try to draw tiles beyond the edge of the map
+        firstx = max(startx, 0)
+        firsty = max(starty, 0)
+        endx = max([min([startx + CAMERA_TILES_X, m.width]), 0])
+        endy = max([min([starty + CAMERA_TILES_Y, m.height]), 0])
 
     logging.debug("Drawing map from %s, %s to %s, %s",
                   startx, starty, endx, endy)
 
-    for j in range(starty, endy):
-        for i in range(startx, endx):
-            if i >= 0 and j >= 0:
-                icon = m.getTile(i, j).tile.icon
-                x = i - startx
-                y = j - starty
-                # logging.debug('drawing {icon} at {x},{y}'.format(icon, x, y))
-                new_screen[x][y] = icon
-
-    entities_to_draw = {}
-    for e in afr.entity.entities:
-        if e.has_component('corporeal'):
-            if startx <= e.x < endx and starty <= e.y < endy:
-                z = e.zorder
-                if z in entities_to_draw:
-                    entities_to_draw[z].append(e)
-                else:
-                    entities_to_draw[z] = [e]
-    for z in sorted(entities_to_draw.keys()):
-        for e in entities_to_draw[z]:
-            # logging.debug("Drawing %s" % e.name)
-            icon = e.icon
-            x = e.x - startx
-            y = e.y - starty
-            # print 'drawing {icon} at {x},{y}'.format(icon=icon, x=x, y=y)
-            new_screen[x][y] = icon
-
-    # Ugly transformation since our buffer is by-column but we print by-row
-    for line in range(CAMERA_TILES_Y):
-        print(''.join([i[line] for i in new_screen]))
+    # This is our buffer, one list of icons per screen row.
+    rows = [[' '] * CAMERA_TILES_X for j in range(CAMERA_TILES_Y)]
+    if firstx < endx:
+        for j in range(firsty, endy):
+            rows[j - starty][firstx - startx:endx - startx] = \
+                m.row_icons(j, firstx, endx)
+
+    # Stable sort, so equal zorders keep index order
+    for e in sorted(afr.entity.spatial.in_rect(startx, starty, endx, endy),
+                    key=lambda e: e.zorder):
+        # logging.debug("Drawing %s" % e.name)
+        rows[e.y - starty][e.x - startx] = e.icon
+
+    if visible is not None:
+        for j, row in enumerate(rows):
+            for i in range(CAMERA_TILES_X):
+                if (startx + i, starty + j) not in visible:
+                    row[i] = ' '
+
+    frame = [''.join(row) for row in rows]
+    if renderer is None:
+        sys.stdout.write('\n'.join(frame) + '\n')
+    else:
+        renderer.render(frame)
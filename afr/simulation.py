@@ -0,0 +1,173 @@
+"""Headless simulation runs.
+
+Builds worlds and runs game.tick without reading stdin or drawing the map,
+for balance testing and soak runs. Run as a script for a quick report:
+
+    python -m afr.simulation --ticks 1000 --worlds 10 --processes 4
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import time
+
+from afr import game
+from afr import profiling
+from afr import world
+
+MAP_WIDTH = 40
+MAP_HEIGHT = 40
+ROOMS = 5
+
+
+def build_world(width=MAP_WIDTH, height=MAP_HEIGHT, rooms=ROOMS, seed=None,
+                chunked=False):
+    """Create, activate and populate a fresh World.
+
+    chunked=True gives it an unbounded afr.chunkedmap.ChunkedMap instead;
+    width, height and rooms are then ignored.
+
+    Returns (world, player entity).
+    """
+    w = world.World(seed=seed).activate()
+    if chunked:
+        w.create_chunked_map()
+    else:
+        w.create_map(width=width, height=height)
+        w.map.generate_interior(rooms=rooms)
+    return w, game.populate(w.map)
+
+
+def run(ticks, actions=None, seed=None, **world_args):
+    """Build a world and run it for up to ticks turns.
+
+    actions is an iterable of player action names (see player.KEY_MAP) to
+    script the player with; once it runs out (or if it's None) the player's
+    own AI takes over. Turns where a scripted action fails don't count.
+    world_args are passed to build_world.
+
+    Returns a dict describing the run.
+    """
+    actions = iter(actions) if actions is not None else iter(())
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        start = time.time()
+        w, p = build_world(seed=seed, **world_args)
+        built = time.time()
+        n_tick = 0
+        outcome = 'tick limit'
+        while n_tick < ticks:
+            try:
+                if game.tick(action=next(actions, None)):
+                    n_tick += 1
+            except game.GameOver:
+                outcome = 'player died'
+                break
+        end = time.time()
+    return {
+        'seed': w.seed,
+        'ticks': n_tick,
+        'outcome': outcome,
+        'player_hp': p.current_hp,
+        'build_seconds': built - start,
+        'seconds': end - built,
+        'ticks_per_second': n_tick / (end - built) if end > built else None,
+    }
+
+
+def run_many(worlds, ticks, seed=None, **kwargs):
+    """Run worlds independent simulations back to back, yielding results.
+
+    If seed is given, world n is seeded with seed + n.
+    """
+    for n in range(worlds):
+        yield run(ticks, seed=None if seed is None else seed + n, **kwargs)
+
+
+def run_batch(seeds, ticks, processes=None, **kwargs):
+    """Run one simulation per seed across a pool of worker processes.
+
+    Each worker builds its own World, so runs share no state. A seed of None
+    picks a random one (reported in the result). Results are yielded as runs
+    finish, not in seed order. processes defaults to the number of CPUs.
+    """
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(run, ticks, seed=seed, **kwargs)
+                   for seed in seeds]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def main():
+    """Command line entry point: print one JSON result per world."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ticks', type=int, default=1000,
+                        help='maximum turns per world')
+    parser.add_argument('--worlds', type=int, default=1,
+                        help='number of worlds to run back to back')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the first world; later worlds count up')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='worker processes to spread worlds across')
+    parser.add_argument('--width', type=int, default=MAP_WIDTH)
+    parser.add_argument('--height', type=int, default=MAP_HEIGHT)
+    parser.add_argument('--rooms', type=int, default=ROOMS)
+    parser.add_argument('--chunked', action='store_true',
+                        help='use an unbounded, lazily generated map')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='write tick timings and counters to FILE')
+    parser.add_argument('--profile-every', type=int, default=100,
+                        metavar='N', help='ticks per --profile report')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='dump cProfile stats for --cprofile-ticks')
+    parser.add_argument('--cprofile-ticks', type=int, nargs=2,
+                        default=(0, 100), metavar=('START', 'STOP'),
+                        help='ticks to run cProfile between')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR,
+                        format="%(filename)s (%(funcName)s) %(message)s")
+    profiling_on = args.profile or args.cprofile
+    if profiling_on and args.processes > 1:
+        parser.error("Profiling only works with --processes 1")
+
+    total_ticks = 0
+    total_seconds = 0
+    world_args = dict(width=args.width, height=args.height,
+                      rooms=args.rooms, chunked=args.chunked)
+    if args.processes > 1:
+        if args.seed is None:
+            seeds = [None] * args.worlds
+        else:
+            seeds = range(args.seed, args.seed + args.worlds)
+        results = run_batch(seeds, args.ticks, processes=args.processes,
+                            **world_args)
+    else:
+        results = run_many(args.worlds, args.ticks, seed=args.seed,
+                           **world_args)
+    if profiling_on:
+        profile_file = open(args.profile, 'w') if args.profile else None
+        profiling.enable(profiling.Profiler(
+            stream=profile_file, every=args.profile_every,
+            cprofile_window=args.cprofile_ticks if args.cprofile else None,
+            cprofile_path=args.cprofile))
+    start = time.time()
+    for result in results:
+        total_ticks += result['ticks']
+        total_seconds += result['seconds']
+        print(json.dumps(result, sort_keys=True))
+    wall_seconds = time.time() - start
+    if profiling_on:
+        profiling.disable()
+        if profile_file is not None:
+            profile_file.close()
+    if total_seconds:
+        print(json.dumps({'total_ticks': total_ticks,
+                          'ticks_per_second': total_ticks / total_seconds,
+                          'wall_ticks_per_second':
+                              total_ticks / wall_seconds}))
+
+if __name__ == '__main__':
+    main()
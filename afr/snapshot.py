@@ -0,0 +1,266 @@
+"""Binary world snapshots.
+
+A snapshot holds everything needed to carry on a World later: the terrain as
+one packed byte per tile, every entity with the state of its components, the
+random streams and the scheduler. Layout:
+
+    header      MAGIC, VERSION, width, height, terrain offset, value offset
+    terrain     width * height tile type ids, row-major (see afr.map)
+    neighbors   width * height neighbor masks, so they needn't be rebuilt
+    free cells  the map's free cell list as int32s, in order
+    value       one tagged value (see _encode) with everything else
+
+Component state is stored as plain values (numbers, strings, lists, dicts)
+with entity references replaced by entity ids, so no object graph is
+pickled. load() memory-maps the file and copies the terrain and neighbor
+masks out in one go each.
+
+    afr.snapshot.save(world, 'game.afrs')
+    world = afr.snapshot.load('game.afrs')
+"""
+
+import array
+import mmap
+import os
+import struct
+
+import afr.entity
+import afr.entitycomponents
+import afr.map
+import afr.world
+
+MAGIC = b'AFRS'
+VERSION = 1
+# magic, version, width, height, terrain offset, value offset
+HEADER = struct.Struct('<4sHIIQQ')
+
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_COUNT = struct.Struct('<I')
+
+
+class SnapshotError(Exception):
+
+    """Raised for unreadable snapshots and unsaveable state."""
+
+    pass
+
+
+def _encode(value, out, ids):
+    """Append the tagged encoding of value to out, a list of bytes.
+
+    ids maps entities to their snapshot ids; entities not in it yet are
+    given the next id, so the caller can save them too.
+    """
+    if value is None:
+        out.append(b'N')
+    elif value is True:
+        out.append(b'T')
+    elif value is False:
+        out.append(b'F')
+    elif isinstance(value, int):
+        if -2 ** 63 <= value < 2 ** 63:
+            out.append(b'i' + _INT.pack(value))
+        else:
+            data = str(value).encode('ascii')
+            out.append(b'L' + _COUNT.pack(len(data)) + data)
+    elif isinstance(value, float):
+        out.append(b'f' + _FLOAT.pack(value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out.append(b's' + _COUNT.pack(len(data)) + data)
+    elif isinstance(value, (list, tuple)):
+        out.append((b'l' if isinstance(value, list) else b't') +
+                   _COUNT.pack(len(value)))
+        for item in value:
+            _encode(item, out, ids)
+    elif isinstance(value, dict):
+        out.append(b'd' + _COUNT.pack(len(value)))
+        for key, item in value.items():
+            _encode(key, out, ids)
+            _encode(item, out, ids)
+    elif isinstance(value, afr.entity.Entity):
+        if value not in ids:
+            ids[value] = len(ids)
+        out.append(b'e' + _COUNT.pack(ids[value]))
+    else:
+        raise SnapshotError("Can't save %r" % (value,))
+
+
+def _decode(buf, pos, entities):
+    """Decode the value at buf[pos:]. Return (value, position after it).
+
+    entities is the list of entities to resolve references against.
+    """
+    tag = buf[pos:pos + 1]
+    pos += 1
+    if tag == b'N':
+        return None, pos
+    elif tag == b'T':
+        return True, pos
+    elif tag == b'F':
+        return False, pos
+    elif tag == b'i':
+        return _INT.unpack_from(buf, pos)[0], pos + _INT.size
+    elif tag == b'f':
+        return _FLOAT.unpack_from(buf, pos)[0], pos + _FLOAT.size
+    elif tag == b'e':
+        return entities[_COUNT.unpack_from(buf, pos)[0]], pos + _COUNT.size
+    count = _COUNT.unpack_from(buf, pos)[0]
+    pos += _COUNT.size
+    if tag == b's':
+        return bytes(buf[pos:pos + count]).decode('utf-8'), pos + count
+    elif tag == b'L':
+        return int(bytes(buf[pos:pos + count])), pos + count
+    elif tag in (b'l', b't'):
+        items = []
+        for i in range(count):
+            item, pos = _decode(buf, pos, entities)
+            items.append(item)
+        return (items if tag == b'l' else tuple(items)), pos
+    elif tag == b'd':
+        items = {}
+        for i in range(count):
+            key, pos = _decode(buf, pos, entities)
+            items[key], pos = _decode(buf, pos, entities)
+        return items, pos
+    raise SnapshotError("Unknown tag %r at byte %s" % (tag, pos - 1))
+
+
+def _entity_order(world):
+    """Return the world's entities in the order to recreate them.
+
+    Entities are recreated in registry order, so queries iterate in the same
+    order after loading.
+    """
+    order = {}
+    for members in world.registry.by_component.values():
+        order.update(members)
+    for e in world.entities:
+        order.setdefault(e, None)
+    return list(order)
+
+
+def save(world, path):
+    """Write a snapshot of world (which must have a map) to path."""
+    m = world.map
+    if not isinstance(m, afr.map.Map):
+        raise SnapshotError("Only afr.map.Map maps can be saved")
+    entities = _entity_order(world)
+    ids = dict((e, i) for i, e in enumerate(entities))
+    records = []
+    # Component state may refer to entities outside the world (eg items in
+    # an inventory). _encode gives those ids as it meets them, and they're
+    # appended to entities to be saved in turn.
+    for e in entities:
+        record = [(component.__class__.__name__, component.get_state())
+                  for component in e.components.values()]
+        known = len(ids)
+        _encode(record, [], ids)
+        if len(ids) > known:
+            entities.extend(list(ids)[known:])
+        records.append(record)
+
+    scheduler = world.scheduler
+    value = {
+        'seed': world.seed,
+        'cluster_size': (m.hierarchy.cluster_size
+                         if m.hierarchy is not None else None),
+        'rng': world.rng.getstate(),
+        'entities': [(e.name, e in world.entities, record)
+                     for e, record in zip(entities, records)],
+        'scheduler': (scheduler.time,
+                      [(due, ids[e]) for due, e in scheduler.pending()],
+                      [ids[e] for e in scheduler.parked]),
+    }
+    out = []
+    _encode(value, out, ids)
+
+    free = m.free_cells()
+    terrain_offset = HEADER.size
+    value_offset = terrain_offset + 2 * len(m.terrain) + \
+        _COUNT.size + len(free) * free.itemsize
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, m.width, m.height,
+                            terrain_offset, value_offset))
+        f.write(m.terrain)
+        f.write(m.neighbors)
+        f.write(_COUNT.pack(len(free)))
+        f.write(free.tobytes())
+        f.write(b''.join(out))
+
+
+def load(path):
+    """Return a new, active World restored from the snapshot at path."""
+    with open(path, 'rb') as f:
+        # mmap can't map an empty file, so check the size first
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise SnapshotError("%s is too short to be a snapshot" % path)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            magic, version, width, height, terrain_offset, value_offset = \
+                HEADER.unpack_from(buf)
+            if magic != MAGIC:
+                raise SnapshotError("%s is not a snapshot" % path)
+            if version != VERSION:
+                raise SnapshotError("%s is snapshot version %s, not %s" %
+                                    (path, version, VERSION))
+            size = width * height
+            terrain = buf[terrain_offset:terrain_offset + size]
+            neighbors = buf[terrain_offset + size:terrain_offset + 2 * size]
+            pos = terrain_offset + 2 * size
+            count = _COUNT.unpack_from(buf, pos)[0]
+            pos += _COUNT.size
+            free = array.array('i')
+            free.frombytes(buf[pos:pos + count * free.itemsize])
+
+            # References may come before the entity they point at is decoded,
+            # so blank entities are made on demand and filled in afterwards.
+            entities = []
+            value = _decode(buf, value_offset, _BlankEntities(entities))[0]
+    while len(entities) < len(value['entities']):
+        entities.append(afr.entity.Entity(None, []))
+
+    world = afr.world.World(seed=value['seed']).activate()
+    m = world.create_map(width=width, height=height, terrain=terrain,
+                         neighbors=neighbors)
+    if value['cluster_size'] is not None:
+        m.enable_hierarchical_pathfinding(value['cluster_size'])
+    world.rng.setstate(value['rng'])
+
+    for (name, in_world, record), e in zip(value['entities'], entities):
+        e.name = name
+        for class_name, state in record:
+            cls = getattr(afr.entitycomponents, class_name, None)
+            if cls is None:
+                raise SnapshotError("Unknown component %s" % class_name)
+            component = cls.__new__(cls)
+            component.set_state(state)
+            e.attach_component(component)
+        if in_world:
+            world.entities.add(e)
+    m.load_free_cells(free)
+
+    time, pending, parked = value['scheduler']
+    scheduler = world.scheduler
+    for e in entities:
+        scheduler.unschedule(e)
+    scheduler.time = time
+    for due, i in pending:
+        scheduler.schedule(entities[i], due - time)
+    for i in parked:
+        scheduler.schedule(entities[i])
+        scheduler.park(entities[i])
+    return world
+
+
+class _BlankEntities(object):
+
+    """Entity list for _decode that creates blank entities on first use."""
+
+    def __init__(self, entities):
+        self.entities = entities
+
+    def __getitem__(self, i):
+        while len(self.entities) <= i:
+            self.entities.append(afr.entity.Entity(None, []))
+        return self.entities[i]
@@ -0,0 +1,172 @@
+"""Spatial index of corporeal entities.
+
+Buckets entities by the tile they occupy so position queries don't have to
+scan every entity in the game.
+"""
+
+
+class SpatialIndex(object):
+
+    """Maps tile coordinates to the corporeal entities standing on them.
+
+    Entities are added/removed by the Corporeal component as it is
+    attached/detached, and re-bucketed by Entity whenever x, y or
+    blocks_movement changes.
+
+    If listener is set, its cell_blocked(x, y) and cell_unblocked(x, y) are
+    called as tiles gain their first or lose their last blocking entity.
+    """
+
+    def __init__(self):
+        """Create an empty index."""
+        # (x, y) -> list of entities on that tile
+        self.cells = {}
+        # entity -> (x, y) it is currently bucketed under
+        self.positions = {}
+        # entities counted as blocking their tile
+        self.blocking = set()
+        # (x, y) -> number of blocking entities there
+        self.blockers = {}
+        self.listener = None
+
+    def __contains__(self, entity):
+        """True if the entity is indexed."""
+        return entity in self.positions
+
+    def __len__(self):
+        """Number of indexed entities."""
+        return len(self.positions)
+
+    def add(self, entity):
+        """Start tracking entity at its current position."""
+        if entity in self.positions:
+            raise ValueError("%s is already indexed." % entity)
+        pos = (entity.x, entity.y)
+        self.positions[entity] = pos
+        self.cells.setdefault(pos, []).append(entity)
+        if entity.blocks_movement:
+            self.blocking.add(entity)
+            self._block(pos)
+
+    def remove(self, entity):
+        """Stop tracking entity."""
+        pos = self.positions.pop(entity)
+        cell = self.cells[pos]
+        cell.remove(entity)
+        if not cell:
+            del(self.cells[pos])
+        if entity in self.blocking:
+            self.blocking.discard(entity)
+            self._unblock(pos)
+
+    def update(self, entity):
+        """Re-bucket entity after its x, y or blocks_movement changed."""
+        old = self.positions[entity]
+        new = (entity.x, entity.y)
+        was_blocking = entity in self.blocking
+        blocks = bool(entity.blocks_movement)
+        if old == new and was_blocking == blocks:
+            return
+        if old != new:
+            cell = self.cells[old]
+            cell.remove(entity)
+            if not cell:
+                del(self.cells[old])
+            self.positions[entity] = new
+            self.cells.setdefault(new, []).append(entity)
+        if was_blocking:
+            self.blocking.discard(entity)
+            self._unblock(old)
+        if blocks:
+            self.blocking.add(entity)
+            self._block(new)
+
+    def _block(self, pos):
+        count = self.blockers.get(pos, 0)
+        self.blockers[pos] = count + 1
+        if not count and self.listener is not None:
+            self.listener.cell_blocked(*pos)
+
+    def _unblock(self, pos):
+        count = self.blockers[pos] - 1
+        if count:
+            self.blockers[pos] = count
+        else:
+            del(self.blockers[pos])
+            if self.listener is not None:
+                self.listener.cell_unblocked(*pos)
+
+    def at(self, x, y):
+        """Return a list of entities at x,y."""
+        return list(self.cells.get((x, y), ()))
+
+    def blocked(self, x, y):
+        """True if an entity blocking movement is at x,y."""
+        return (x, y) in self.blockers
+
+    def nearest(self, x, y, radius, match=None):
+        """Return the entity closest to x,y within radius, or None.
+
+        Distance is euclidean, compared squared. match is an optional
+        function entity -> bool that candidates must pass. Ties go to the
+        lowest y, then x, then the entity that arrived on the tile first.
+
+        Scans outwards one square ring at a time and stops once a ring can't
+        beat the best found, unless the index is sparse enough that checking
+        every occupied tile is cheaper.
+        """
+        limit = radius * radius
+        best = None
+        best_key = None
+        if (2 * radius + 1) ** 2 > len(self.cells):
+            tiles = [pos for pos in self.cells
+                     if (pos[0] - x) ** 2 + (pos[1] - y) ** 2 <= limit]
+            rings = [tiles]
+        else:
+            rings = (self._ring(x, y, r) for r in range(radius + 1))
+        for r, tiles in enumerate(rings):
+            if best_key is not None and r * r > best_key[0]:
+                # Everything further out is at least r away
+                break
+            for pos in tiles:
+                cell = self.cells.get(pos)
+                if not cell:
+                    continue
+                d = (pos[0] - x) ** 2 + (pos[1] - y) ** 2
+                if d > limit:
+                    continue
+                for n, e in enumerate(cell):
+                    key = (d, pos[1], pos[0], n)
+                    if best_key is not None and key >= best_key:
+                        break
+                    if match is None or match(e):
+                        best = e
+                        best_key = key
+                        break
+        return best
+
+    def _ring(self, x, y, r):
+        """Return the tiles at chebyshev distance r from x,y."""
+        if r == 0:
+            return [(x, y)]
+        tiles = [(i, y - r) for i in range(x - r, x + r + 1)]
+        tiles.extend((i, y + r) for i in range(x - r, x + r + 1))
+        for j in range(y - r + 1, y + r):
+            tiles.append((x - r, j))
+            tiles.append((x + r, j))
+        return tiles
+
+    def in_rect(self, x1, y1, x2, y2):
+        """Return entities with x1 <= x < x2 and y1 <= y < y2."""
+        found = []
+        area = max(x2 - x1, 0) * max(y2 - y1, 0)
+        if area <= len(self.cells):
+            for y in range(y1, y2):
+                for x in range(x1, x2):
+                    found.extend(self.cells.get((x, y), ()))
+        else:
+            # Sparse index: cheaper to walk the occupied cells instead
+            for (x, y), cell in self.cells.items():
+                if x1 <= x < x2 and y1 <= y < y2:
+                    found.extend(cell)
+        return found
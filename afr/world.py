@@ -0,0 +1,76 @@
+"""Per-world game state.
+
+Game code reaches the world it's working on through module globals:
+afr.map.map, afr.entity.entities, afr.entity.spatial, afr.entity.registry,
+afr.rng.streams and afr.scheduler.scheduler. A World owns one set of that
+state and activate() points the globals at it, so several worlds can be
+built and run one after another (or one per worker process) without leaking
+entities or terrain into each other.
+"""
+
+import afr.chunkedmap
+import afr.entity
+import afr.map
+import afr.registry
+import afr.rng
+import afr.scheduler
+import afr.spatial
+
+# The world the module globals currently point at, if any
+current = None
+
+
+class World(object):
+
+    """A map plus the entities living on it."""
+
+    def __init__(self, seed=None):
+        """Create an empty world.
+
+        seed seeds the world's random streams (see afr.rng); None picks one.
+        """
+        self.rng = afr.rng.Streams(seed)
+        self.seed = self.rng.seed
+        self.map = None
+        self.entities = set()
+        self.spatial = afr.spatial.SpatialIndex()
+        self.registry = afr.registry.ComponentRegistry()
+        self.scheduler = afr.scheduler.Scheduler()
+
+    def activate(self):
+        """Make this the world the game globals refer to. Returns self."""
+        global current
+        afr.map.map = self.map
+        afr.entity.entities = self.entities
+        afr.entity.spatial = self.spatial
+        afr.entity.registry = self.registry
+        afr.rng.streams = self.rng
+        afr.scheduler.scheduler = self.scheduler
+        current = self
+        return self
+
+    def create_map(self, **kwargs):
+        """Create this world's Map, passing kwargs on. Returns the map.
+
+        The map generates from this world's mapgen stream.
+        """
+        kwargs.setdefault('rng', self.rng.mapgen)
+        self.map = afr.map.Map(**kwargs)
+        self.map.track_occupancy(self.spatial)
+        if current is self:
+            afr.map.map = self.map
+        return self.map
+
+    def create_chunked_map(self, **kwargs):
+        """Create an afr.chunkedmap.ChunkedMap as this world's map.
+
+        kwargs are passed on; the chunks are seeded from the world's seed
+        and spawn points come from its mapgen stream. Returns the map.
+        """
+        kwargs.setdefault('seed', self.seed)
+        kwargs.setdefault('rng', self.rng.mapgen)
+        self.map = afr.chunkedmap.ChunkedMap(**kwargs)
+        self.map.track_occupancy(self.spatial)
+        if current is self:
+            afr.map.map = self.map
+        return self.map
@@ -0,0 +1,73 @@
+"""Tests for AI sleeping and waking."""
+
+import unittest
+
+from afr import entity
+from afr import entitycomponents
+from afr import game
+from afr import world
+from afr.entitycomponents import ai
+
+
+def _goblin(x, y):
+    goblin = entity.Entity('Goblin', components=[
+        entitycomponents.Creature(max_hp=40, size='small'),
+        entitycomponents.Fighter(strength=10, team='goblins'),
+        entitycomponents.Corporeal(x=x, y=y),
+        entitycomponents.AI(),
+    ])
+    entity.entities.add(goblin)
+    return goblin
+
+
+class SleepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.world = world.World(seed=1).activate()
+        m = self.world.create_map(width=60, height=20)
+        for y in range(1, 19):
+            for x in range(1, 59):
+                m.setTile(x, y, 'floor')
+        # A wall down the middle keeps the goblin out of sight
+        for y in range(0, 20):
+            m.setTile(30, y, 'stone')
+        self.goblin = _goblin(45, 10)
+        self.player = entity.Entity('Urist', components=[
+            entitycomponents.Creature(max_hp=10 ** 6),
+            entitycomponents.Fighter(strength=10, team='dwarves'),
+            entitycomponents.Corporeal(x=5, y=10),
+            entitycomponents.AI(),
+            entitycomponents.Player(),
+        ])
+        entity.entities.add(self.player)
+
+    def _idle(self):
+        for i in range(ai.IDLE_TURNS):
+            game.tick('wait')
+
+    def test_falls_asleep_when_idle(self):
+        self._idle()
+        self.assertTrue(self.goblin.components['ai'].asleep)
+        self.assertIn(self.goblin, self.world.scheduler.parked)
+        self.assertEqual(len(self.world.scheduler), 0)
+
+    def test_wakes_when_attacked(self):
+        self._idle()
+        self.player.attack(self.goblin)
+        self.assertFalse(self.goblin.components['ai'].asleep)
+        self.assertNotIn(self.goblin, self.world.scheduler.parked)
+        self.assertEqual(len(self.world.scheduler), 1)
+
+    def test_wakes_when_player_comes_into_view(self):
+        self._idle()
+        self.goblin.x = self.player.x + 5
+        self.goblin.y = self.player.y
+        self.assertTrue(self.goblin.components['ai'].asleep)
+        game.tick('wait')
+        self.assertFalse(self.goblin.components['ai'].asleep)
+        self.assertIs(self.goblin.components['ai'].brainstate['target'],
+                      self.player)
+
+
+if __name__ == '__main__':
+    unittest.main()
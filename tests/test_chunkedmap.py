@@ -0,0 +1,42 @@
+"""Tests for afr.chunkedmap."""
+
+import unittest
+
+from afr import entity
+from afr import entitycomponents
+from afr import world
+
+
+class ChunkedMapTest(unittest.TestCase):
+
+    def setUp(self):
+        w = world.World(seed=1).activate()
+        self.m = w.create_chunked_map(chunk_size=8, max_chunks=4)
+
+    def test_regenerates_identically(self):
+        before = self.m.row_ids(3, -20, 20)
+        for cx in range(10, 20):
+            self.m.tile_id(cx * 8, 0)
+        self.assertNotIn((-1, 0), self.m.chunks)
+        self.assertEqual(self.m.row_ids(3, -20, 20), before)
+
+    def test_keeps_changes_when_evicted(self):
+        self.m.setTile(1, 1, 'stone')
+        self.m.setTile(2, 1, 'floor')
+        for cx in range(10, 20):
+            self.m.tile_id(cx * 8, 0)
+        self.assertEqual(self.m.tile_type(1, 1).passable, False)
+        self.assertEqual(self.m.tile_type(2, 1).passable, True)
+
+    def test_keeps_chunks_with_entities(self):
+        x, y = self.m.get_empty_coordinates()
+        entity.entities.add(entity.Entity('Urist', components=[
+            entitycomponents.Corporeal(x=x, y=y)]))
+        for cx in range(10, 20):
+            self.m.tile_id(cx * 8, 0)
+        self.assertIn(self.m.chunk_of(x, y), self.m.chunks)
+        self.assertEqual(len(self.m.chunks), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests for Entity attribute access and the get() cache."""
+
+import unittest
+
+from afr import entity
+from afr import entitycomponents
+from afr import world
+
+
+class GetCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        w = world.World(seed=1).activate()
+        w.create_map(width=20, height=20)
+        self.e = entity.Entity('Urist', components=[
+            entitycomponents.Creature(max_hp=10),
+            entitycomponents.Fighter(strength=7, team='dwarves'),
+            entitycomponents.Corporeal(x=3, y=4),
+            entitycomponents.Inventory(),
+        ])
+        entity.entities.add(self.e)
+
+    def test_get_after_move(self):
+        self.assertEqual(self.e.get('x'), 3)
+        self.e.x = 5
+        self.assertEqual(self.e.get('x'), 5)
+        self.assertEqual(entity.spatial.at(5, 4), [self.e])
+
+    def test_get_after_equip(self):
+        sword = entity.Entity('Sword', components=[
+            entitycomponents.Equippable(strength=10)])
+        self.assertEqual(self.e.get('strength'), 7)
+        self.e.inventory.append(sword)
+        self.e.equip(sword)
+        self.assertEqual(self.e.get('strength'), 17)
+
+    def test_get_after_bonus_change(self):
+        sword = entity.Entity('Sword', components=[
+            entitycomponents.Equippable(strength=10)])
+        self.e.inventory.append(sword)
+        self.e.equip(sword)
+        self.assertEqual(self.e.get('strength'), 17)
+        sword.components['equippable'].strength = 1
+        self.assertEqual(self.e.get('strength'), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""Tests for afr.map."""
+
+import heapq
+import unittest
+
+import afr.map
+from afr import world
+
+
+def _map(seed, width=60, height=40, rooms=None):
+    w = world.World(seed=seed).activate()
+    m = w.create_map(width=width, height=height)
+    if rooms is None:
+        m.generate()
+    else:
+        m.generate_interior(rooms=rooms)
+    return m
+
+
+class GenerateTest(unittest.TestCase):
+
+    def test_same_seed_same_map(self):
+        self.assertEqual(_map(3).terrain, _map(3).terrain)
+        self.assertNotEqual(_map(3).terrain, _map(4).terrain)
+
+    @unittest.skipIf(afr.map.numpy is None, "needs NumPy")
+    def test_same_map_without_numpy(self):
+        numpy = afr.map.numpy
+        with_numpy = _map(3)
+        afr.map.numpy = None
+        try:
+            without_numpy = _map(3)
+        finally:
+            afr.map.numpy = numpy
+        self.assertEqual(with_numpy.terrain, without_numpy.terrain)
+        self.assertEqual(with_numpy.neighbors, without_numpy.neighbors)
+
+
+def _cheapest(m, x1, y1, x2, y2):
+    """Cost of the cheapest path by plain Dijkstra, or None."""
+    costs = {(x1, y1): 0}
+    heap = [(0, x1, y1)]
+    while heap:
+        cost, x, y = heapq.heappop(heap)
+        if (x, y) == (x2, y2):
+            return cost
+        if cost > costs[(x, y)]:
+            continue
+        for dx, dy in afr.map.DIRECTIONS:
+            nx = x + dx
+            ny = y + dy
+            if not (0 <= nx < m.width and 0 <= ny < m.height) or \
+                    not m.tile_type(nx, ny).passable:
+                continue
+            new = cost + (afr.map.SQRT2 if dx and dy else 1)
+            if new < costs.get((nx, ny), new + 1):
+                costs[(nx, ny)] = new
+                heapq.heappush(heap, (new, nx, ny))
+    return None
+
+
+def _path_cost(m, x, y, path):
+    """Check path is a walk of adjacent passable tiles; return its cost."""
+    cost = 0
+    for tile in path:
+        dx = abs(tile.x - x)
+        dy = abs(tile.y - y)
+        assert max(dx, dy) == 1, "path jumps from %s,%s to %s" % (x, y, tile)
+        assert m.tile_type(tile.x, tile.y).passable
+        cost += afr.map.SQRT2 if dx and dy else 1
+        x, y = tile.x, tile.y
+    return cost
+
+
+class PathfindTest(unittest.TestCase):
+
+    def test_astar_finds_cheapest_path(self):
+        for seed in range(5):
+            m = _map(seed, rooms=8)
+            for i in range(10):
+                (x1, y1), (x2, y2) = m.get_many_empty_coordinates(2)
+                path = m.pathfind(x1, y1, x2, y2)
+                best = _cheapest(m, x1, y1, x2, y2)
+                if best is None:
+                    self.assertIsNone(path)
+                    continue
+                self.assertEqual((path[-1].x, path[-1].y), (x2, y2))
+                self.assertAlmostEqual(_path_cost(m, x1, y1, path), best)
+
+    def test_already_there(self):
+        m = _map(1, rooms=4)
+        x, y = m.get_empty_coordinates()
+        self.assertEqual(m.pathfind(x, y, x, y), [])
+
+
+class HierarchicalPathfindTest(unittest.TestCase):
+
+    def setUp(self):
+        self.m = _map(2, width=96, height=64, rooms=12)
+        self.m.enable_hierarchical_pathfinding(cluster_size=8)
+
+    def _check_paths(self, trips=20):
+        m = self.m
+        for i in range(trips):
+            (x1, y1), (x2, y2) = m.get_many_empty_coordinates(2)
+            path = m.pathfind(x1, y1, x2, y2)
+            if _cheapest(m, x1, y1, x2, y2) is None:
+                self.assertIsNone(path)
+                continue
+            self.assertIsNotNone(path)
+            if path:
+                self.assertEqual((path[-1].x, path[-1].y), (x2, y2))
+            _path_cost(m, x1, y1, path)
+
+    def test_paths_are_connected(self):
+        self._check_paths()
+
+    def test_paths_after_set_tile(self):
+        m = self.m
+        # Wall off a column of each cluster border, then open some up
+        for y in range(m.height):
+            for x in range(8, m.width, 16):
+                m.setTile(x, y, 'stone')
+        for y in range(4, m.height, 8):
+            for x in range(8, m.width, 16):
+                m.setTile(x, y, 'floor')
+        self._check_paths()
+        # A path through a tile that's since been walled off must avoid it
+        (x1, y1), (x2, y2) = m.get_many_empty_coordinates(2)
+        path = m.pathfind(x1, y1, x2, y2)
+        if path and len(path) > 1:
+            middle = path[len(path) // 2]
+            m.setTile(middle.x, middle.y, 'stone')
+            path = m.pathfind(x1, y1, x2, y2)
+            if path is not None:
+                self.assertNotIn((middle.x, middle.y),
+                                 [(t.x, t.y) for t in path])
+                _path_cost(m, x1, y1, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
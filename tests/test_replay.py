@@ -0,0 +1,68 @@
+"""Tests for afr.replay."""
+
+import contextlib
+import io
+import unittest
+
+import afr.scheduler
+from afr import game
+from afr import replay
+from afr import simulation
+
+ACTIONS = ['move-left', 'move-right-up', 'wait', None, 'move-down', None,
+           'pick-up', 'move-up', None, 'wait']
+
+
+def _record(ticks=60, checkpoint_every=10):
+    world_args = {'width': 40, 'height': 40, 'rooms': 5}
+    stream = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()):
+        w, p = simulation.build_world(seed=7, **world_args)
+        recorder = replay.Recorder(stream, w.seed, world_args,
+                                   checkpoint_every=checkpoint_every)
+        for i in range(ticks):
+            try:
+                recorder.tick(ACTIONS[i % len(ACTIONS)])
+            except game.GameOver:
+                break
+    return stream.getvalue(), recorder
+
+
+class ReplayTest(unittest.TestCase):
+
+    def test_replay_passes_checkpoints(self):
+        log, recorder = _record()
+        checkpoints = log.count('\n=')
+        self.assertGreater(checkpoints, 0)
+        result = replay.replay(io.StringIO(log))
+        self.assertEqual(result['checkpoints_verified'], checkpoints)
+        self.assertEqual(result['ticks'], recorder.ticks)
+
+    def test_desync_detected(self):
+        log, recorder = _record()
+        lines = log.splitlines(True)
+        n = max(i for i, line in enumerate(lines) if line.startswith('='))
+        ticks = lines[n].split(' ')[0]
+        lines[n] = '%s %s\n' % (ticks, '0' * 40)
+        self.assertRaises(replay.ReplayError, replay.replay,
+                          io.StringIO(''.join(lines)))
+        # Without verifying the same log plays through
+        result = replay.replay(io.StringIO(''.join(lines)), verify=False)
+        self.assertEqual(result['checkpoints_verified'], 0)
+
+    def test_unknown_action_not_recorded(self):
+        log, recorder = _record(ticks=5)
+        stream = recorder.stream
+        time = afr.scheduler.scheduler.time
+        self.assertRaises(ValueError, recorder.tick, 'dance')
+        self.assertEqual(stream.getvalue(), log)
+        self.assertEqual(afr.scheduler.scheduler.time, time)
+        self.assertEqual(recorder.ticks, 5)
+
+    def test_bad_header(self):
+        self.assertRaises(replay.ReplayError, replay.replay,
+                          io.StringIO('not a log\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
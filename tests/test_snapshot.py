@@ -0,0 +1,73 @@
+"""Tests for afr.snapshot."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from afr import entity
+from afr import game
+from afr import simulation
+from afr import snapshot
+from afr import world
+
+
+def _state():
+    return sorted((e.name, getattr(e, 'x', None), getattr(e, 'y', None),
+                   getattr(e, 'current_hp', None))
+                  for e in entity.entities)
+
+
+def _run(ticks):
+    for i in range(ticks):
+        try:
+            game.tick(None)
+        except game.GameOver:
+            break
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'game.afrs')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_load_continues_like_uninterrupted_run(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            w, p = simulation.build_world(seed=4)
+            p.current_hp = p.max_hp = 10 ** 6
+            _run(60)
+            snapshot.save(w, self.path)
+            _run(200)
+            expected = _state()
+            expected_time = w.scheduler.time
+            expected_rng = w.rng.getstate()
+            loaded = snapshot.load(self.path)
+            _run(200)
+        self.assertEqual(_state(), expected)
+        self.assertEqual(loaded.scheduler.time, expected_time)
+        self.assertEqual(loaded.rng.getstate(), expected_rng)
+
+    def test_empty_file(self):
+        open(self.path, 'wb').close()
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, self.path)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 100)
+        self.assertRaises(snapshot.SnapshotError, snapshot.load, self.path)
+
+    def test_chunked_map_refused(self):
+        w = world.World(seed=1).activate()
+        w.create_chunked_map()
+        self.assertRaises(snapshot.SnapshotError, snapshot.save, w,
+                          self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()